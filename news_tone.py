@@ -0,0 +1,188 @@
+""" news_tone.py
+Tone scoring of a corpus of news articles, built from `freqword` in week5.py.
+
+`freqword` counts the words of one file in a dict. Here every article file
+is streamed line by line, tokenized with one compiled regex, and its tokens
+are counted against sentiment word lists (e.g. negative, positive and
+uncertainty words). The word lists are merged once into a lexicon, a dict
+mapping each word to the categories it belongs to, so each distinct token
+of an article costs one hash lookup. Files are scored in parallel across
+processes.
+
+Article files are named `<tic>_<YYYY-MM-DD>[_<anything>].txt`, e.g.
+`aapl_2020-01-02_1.txt`; another naming scheme can be handled by passing a
+different `parse_name` function.
+
+The output is one row per (ticker, date) with the word counts and the tone
+
+    tone = (n_positive - n_negative) / n_words
+
+which the event-study stage can merge with returns on ('ticker', 'date').
+"""
+
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+TOKEN_RE = re.compile(r"[a-z]+(?:'[a-z]+)?")
+NAME_RE = re.compile(r'^(?P<tic>[^_]+)_(?P<date>\d{4}-\d{2}-\d{2})')
+
+# Lexicon used by the worker processes, set by `_init_worker`
+_LEXICON = None
+
+
+def load_word_list(pth):
+    """ Returns the set of lower-case words in the file at `pth`, one word per
+    line (the format of the Loughran-McDonald sentiment word lists).
+    Blank lines and lines starting with '#' are skipped.
+    """
+    with open(pth) as file:
+        return {line.strip().lower() for line in file if line.strip() and not line.startswith('#')}
+
+
+def build_lexicon(word_lists):
+    """ Merges sentiment word lists into a lexicon.
+
+    Parameters
+    ----------
+    word_lists : dict
+        A dictionary with format {<category> : <iterable of words>}, e.g.
+        {'negative': load_word_list('neg.txt'), 'positive': {...}}
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<word> : <tuple of category positions>}, where
+        the positions refer to the order of the keys of `word_lists`.
+    """
+    lexicon = {}
+    for i, words in enumerate(word_lists.values()):
+        for word in words:
+            lexicon[word.lower()] = lexicon.get(word.lower(), ()) + (i,)
+    return lexicon
+
+
+def parse_name(pth):
+    """ Returns (ticker, date string) from an article file name, see the module docstring.
+
+    Raises
+    ------
+    ValueError
+        If the file name does not follow `<tic>_<YYYY-MM-DD>...`.
+    """
+    match = NAME_RE.match(os.path.basename(pth))
+    if match is None:
+        raise ValueError("Cannot read ticker and date from article file name {}".format(pth))
+    return match['tic'].lower(), match['date']
+
+
+def score_lines(lines, lexicon, n_cat):
+    """ Returns [n_words, count of category 0, count of category 1, ...] for an
+    iterable of text lines.
+    """
+    tokens = Counter()
+    for line in lines:
+        tokens.update(TOKEN_RE.findall(line.lower()))
+
+    counts = [sum(tokens.values())] + [0] * n_cat
+    for word, n in tokens.items():
+        for i in lexicon.get(word, ()):
+            counts[i + 1] += n
+    return counts
+
+
+def score_file(pth, lexicon, n_cat):
+    """ Returns the output of `score_lines` for the article file at `pth`, reading it line by line. """
+    with open(pth, encoding='utf-8', errors='replace') as file:
+        return score_lines(file, lexicon, n_cat)
+
+
+def _init_worker(lexicon):
+    global _LEXICON
+    _LEXICON = lexicon
+
+
+def _score_worker(args):
+    pth, n_cat = args
+    return score_file(pth, _LEXICON, n_cat)
+
+
+def tone_table(pths, word_lists, max_workers=None, chunksize=64, parse_name=parse_name):
+    """ Scores article files and returns their tone by (ticker, date).
+
+    Parameters
+    ----------
+    pths : list
+        Locations of the article files.
+    word_lists : dict
+        A dictionary with format {<category> : <iterable of words>}. It must
+        contain 'negative' and 'positive'; any other category (e.g. 'uncertainty')
+        is counted too.
+    max_workers : int, optional
+        Number of worker processes. If 1, files are scored in this process.
+        If None, one per CPU.
+    chunksize : int
+        Number of files sent to a worker at a time.
+    parse_name : callable
+        Function returning (ticker, date string) from a file location.
+
+    Returns
+    -------
+    df
+        A DataFrame with one row per (ticker, date), sorted by them, and columns
+        'ticker', 'date' (datetime64), 'n_articles', 'n_words', one count column
+        per category (e.g. 'negative'), and 'tone'. Counts of articles on the
+        same ticker and date are added up before the tone is computed.
+    """
+    if not {'negative', 'positive'} <= set(word_lists):
+        raise ValueError("`word_lists` must contain 'negative' and 'positive' word lists")
+    categories = list(word_lists)
+    lexicon = build_lexicon(word_lists)
+    keys = [parse_name(pth) for pth in pths]
+
+    if max_workers == 1:
+        counts = [score_file(pth, lexicon, len(categories)) for pth in pths]
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(lexicon,)) as executor:
+            tasks = [(pth, len(categories)) for pth in pths]
+            counts = list(executor.map(_score_worker, tasks, chunksize=chunksize))
+
+    df = pd.DataFrame(counts, columns=['n_words'] + categories)
+    df.insert(0, 'ticker', [tic for tic, _ in keys])
+    df.insert(1, 'date', pd.to_datetime([date for _, date in keys], format='%Y-%m-%d'))
+    df.insert(2, 'n_articles', 1)
+
+    df = df.groupby(['ticker', 'date'], as_index=False, sort=True).sum()
+    df['tone'] = (df['positive'] - df['negative']) / df['n_words'].where(df['n_words'] > 0)
+    return df
+
+
+def _test_tone_table(article_dir):
+    """ Test function for `tone_table`. Writes three made-up articles to
+    `article_dir` and scores them with small word lists.
+    """
+    os.makedirs(article_dir, exist_ok=True)
+    articles = {
+        'aapl_2020-01-02_1.txt': "Apple reported strong growth.\nAnalysts were upbeat.\n",
+        'aapl_2020-01-02_2.txt': "Some analysts see a possible loss next quarter.\n",
+        'tsla_2020-01-03_1.txt': "Tesla faces a lawsuit and a recall; losses widen.\n",
+    }
+    for name, text in articles.items():
+        with open(os.path.join(article_dir, name), 'w') as file:
+            file.write(text)
+
+    word_lists = {
+        'negative': {'loss', 'losses', 'lawsuit', 'recall'},
+        'positive': {'strong', 'growth', 'upbeat'},
+        'uncertainty': {'possible'},
+    }
+    pths = sorted(os.path.join(article_dir, name) for name in articles)
+    print(tone_table(pths, word_lists, max_workers=2))
+
+
+if __name__ == "__main__":
+    pass
+    # _test_tone_table('news_test')
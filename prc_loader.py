@@ -0,0 +1,149 @@
+""" prc_loader.py
+Loads the Yahoo Finance price CSV files in this repo into typed DataFrames.
+
+The files do not agree on the date format: `qan_stk_prc.csv` uses ISO dates
+(2020-01-02) while `qan_prc_2020.csv` uses day-first dates (2/1/2020).
+The format is sniffed once from the first rows of each file and the Date
+column is then parsed with that explicit format, which is vectorized,
+instead of letting pandas infer the format row by row.
+"""
+
+import csv
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+# Column dtypes of a Yahoo Finance price file
+PRC_DTYPES = {
+    'Open': 'float64',
+    'High': 'float64',
+    'Low': 'float64',
+    'Close': 'float64',
+    'Adj Close': 'float64',
+    # Nullable integers, so a missing volume is read as <NA> instead of raising
+    'Volume': 'Int64',
+}
+
+ISO_RE = re.compile(r'^\d{4}-\d{2}-\d{2}')
+SLASH_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4})$')
+
+
+def sniff_date_format(pth, nrows=50):
+    """ Returns the strptime format of the Date column of the CSV file at `pth`,
+    looking only at the first `nrows` data rows.
+
+    Slash-separated dates are treated as day-first (the convention used for
+    ASX data in this repo) unless a value in the sample has a second field
+    larger than 12: that field can only be the day, so the dates are month-first.
+
+    Parameters
+    ----------
+    pth : str
+        Location of the CSV file. The first column must be the date.
+
+    nrows : int
+        Number of data rows to inspect
+
+    Returns
+    -------
+    str
+        Either '%Y-%m-%d', '%d/%m/%Y', or '%m/%d/%Y'
+
+    Raises
+    ------
+    ValueError
+        If the sample contains dates in neither format
+    """
+    with open(pth, 'r', newline='') as file:
+        reader = csv.reader(file)
+        next(reader)
+        sample = [row[0].strip() for _, row in zip(range(nrows), reader) if row]
+
+    if sample and all(ISO_RE.match(d) for d in sample):
+        return '%Y-%m-%d'
+
+    matches = [SLASH_RE.match(d) for d in sample]
+    if sample and all(matches):
+        if any(int(m.group(2)) > 12 for m in matches):
+            return '%m/%d/%Y'
+        return '%d/%m/%Y'
+
+    raise ValueError(f"Unrecognised date format in {pth}: {sample[:3]}")
+
+
+def read_prc_csv(pth, date_format=None):
+    """ Reads a price CSV file into a DataFrame with a DatetimeIndex named 'Date'.
+
+    Parameters
+    ----------
+    pth : str
+        Location of the CSV file
+
+    date_format : str, optional
+        strptime format of the Date column. If None (the default), it is
+        sniffed with `sniff_date_format`.
+
+    Returns
+    -------
+    df
+        A DataFrame with the columns found in the file, typed as in `PRC_DTYPES`
+        (float64 prices, nullable Int64 volume)
+    """
+    if date_format is None:
+        date_format = sniff_date_format(pth)
+    with open(pth, 'r') as file:
+        header = file.readline().strip().split(',')
+    dtypes = {col: PRC_DTYPES[col] for col in header if col in PRC_DTYPES}
+
+    df = pd.read_csv(pth, dtype=dtypes)
+    df['Date'] = pd.to_datetime(df['Date'], format=date_format)
+    return df.set_index('Date')
+
+
+def read_prc_panel(pths, max_workers=None):
+    """ Reads several price CSV files in parallel and stacks them into one panel.
+
+    Parameters
+    ----------
+    pths : dict or list
+        Either a dictionary with format {<tic> : <pth>}, or a list of paths,
+        in which case the ticker is the file name without its extension
+
+    max_workers : int, optional
+        Maximum number of files parsed at the same time. The pandas CSV
+        parser releases the GIL, so threads parse files in parallel.
+
+    Returns
+    -------
+    df
+        A DataFrame with a ('tic', 'Date') MultiIndex and the price columns
+    """
+    if not isinstance(pths, dict):
+        pths = {os.path.splitext(os.path.basename(p))[0]: p for p in pths}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        frames = list(pool.map(read_prc_csv, pths.values()))
+
+    return pd.concat(frames, keys=list(pths.keys()), names=['tic', 'Date'])
+
+
+def _test_read_prc_panel():
+    """ Test function for `read_prc_panel`. The two files hold QAN prices with
+    different date formats; both should come out with a DatetimeIndex
+    starting on 2020-01-02.
+    """
+    base = os.path.dirname(os.path.abspath(__file__))
+    pths = {'iso': os.path.join(base, 'qan_stk_prc.csv'),
+            'dayfirst': os.path.join(base, 'qan_prc_2020.csv')}
+    for tic, pth in pths.items():
+        print(f'{tic}: {sniff_date_format(pth)}')
+    panel = read_prc_panel(pths)
+    print(panel.head())
+    panel.info()
+
+
+if __name__ == "__main__":
+    pass
+    # _test_read_prc_panel()
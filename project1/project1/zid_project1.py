@@ -21,7 +21,6 @@ import json
 ROOTDIR = os.path.join(cfg.BASEDIR, 'project1')
 DATDIR = os.path.join(ROOTDIR, 'data')
 TICPATH = os.path.join(ROOTDIR, 'TICKERS.txt')
-print(DATDIR)
 
 # ----------------------------------------------------------------------------
 # Variables describing the contents of ".dat" files
@@ -0,0 +1,196 @@
+""" zid_project2_analytics.py
+
+Performance analytics of portfolio return tables, e.g. the output of `pf_main`.
+
+`LogReturns` takes the log of |1 + r| once and keeps prefix (cumulative)
+sums of them, with a leading row of zeros:
+
+    P[t] = log|1 + r_1| + ... + log|1 + r_t|,  P[0] = 0
+
+The growth of wealth over rows s+1, ..., t is then exp(P[t] - P[s]), so
+each rolling window costs one subtraction whatever its length:
+    - cumulative return up to t:     exp(P[t]) - 1
+    - return over months s+1, ..., t: exp(P[t] - P[s]) - 1
+    - drawdown at t:                 W[t] / max(W[0], ..., W[t]) - 1, W = exp(P).
+
+Adding logs instead of multiplying (1 + r) keeps the precision of long
+horizons. A long-short return can be -1 or below, so the number of
+negative factors (1 + r < 0) and of zero factors (r = -1) are kept as prefix
+counts too: the growth over a window has the sign (-1)^(negative factors)
+and is 0 if the window has a zero factor, as with `cumprod`. Missing returns
+are skipped (they add 0 to the sums), as in `get_cumulative_ret`. Sharpe and
+Sortino ratios use the simple returns.
+"""
+
+import numpy as np
+import pandas as pd
+import util
+
+SUMMARY_ROWS = ('cum_ret', 'ann_ret', 'ann_vol', 'sharpe', 'sortino', 'max_dd', 'n_obs')
+
+
+def prefix_sums(arr):
+    """ Returns the column prefix sums of the 2-D array `arr`, with a leading row of zeros. """
+    out = np.zeros((arr.shape[0] + 1, arr.shape[1]))
+    np.cumsum(arr, axis=0, out=out[1:])
+    return out
+
+
+class LogReturns:
+    """ Prefix sums of the log returns of every column of a return table.
+
+    Parameters
+    ----------
+    df : df
+        Periodic (e.g. monthly) simple returns, one column per portfolio.
+        NaN marks a missing return.
+    """
+
+    def __init__(self, df):
+        self.index = df.index
+        self.columns = df.columns
+        self.ret = df.to_numpy(dtype=float)
+        self.valid = ~np.isnan(self.ret)
+        factor = np.where(self.valid, 1.0 + self.ret, 1.0)
+        zero = factor == 0
+        with np.errstate(divide='ignore'):
+            self.log = prefix_sums(np.where(zero, 0.0, np.log(np.abs(factor))))
+        self.n_neg = prefix_sums((factor < 0).astype(float))
+        self.n_zero = prefix_sums(zero.astype(float))
+        self.count = prefix_sums(self.valid.astype(float))
+
+    def growth(self, stop, start):
+        """ Returns the product of (1 + r) over rows start+1, ..., stop (prefix-sum
+        positions, arrays of equal shape), with its sign and zeros as with `cumprod`.
+        """
+        sign = 1.0 - 2.0 * ((self.n_neg[stop] - self.n_neg[start]) % 2)
+        res = sign * np.exp(self.log[stop] - self.log[start])
+        res[self.n_zero[stop] - self.n_zero[start] > 0] = 0.0
+        return res
+
+    def _frame(self, arr):
+        return pd.DataFrame(arr, index=self.index, columns=self.columns)
+
+    def cumulative(self):
+        """ Returns the buy and hold return from the first row up to each row,
+        NaN where the return is missing.
+        """
+        rows = np.arange(1, len(self.index) + 1)
+        cum = self.growth(rows, np.zeros_like(rows)) - 1
+        cum[~self.valid] = np.nan
+        return self._frame(cum)
+
+    def rolling(self, n, min_periods=None):
+        """ Returns the compounded return over each window of `n` rows ending at each row.
+
+        Parameters
+        ----------
+        n : int
+            Window length in rows (e.g. 12 for 12-month returns on monthly data).
+        min_periods : int, optional
+            The number of non-missing returns a window needs. Defaults to `n`.
+            Rows with fewer, including the first n-1 rows, are NaN.
+        """
+        min_periods = n if min_periods is None else min_periods
+        out = np.full(self.ret.shape, np.nan)
+        if n <= len(self.index):
+            stop = np.arange(n, len(self.index) + 1)
+            out[n - 1:] = self.growth(stop, stop - n) - 1
+            n_obs = self.count[n:] - self.count[:-n]
+            out[n - 1:][n_obs < min_periods] = np.nan
+        return self._frame(out)
+
+    def drawdown(self):
+        """ Returns the loss from the highest wealth reached so far (starting wealth
+        included) at each row, as a negative number or 0. NaN where the return is missing.
+        """
+        rows = np.arange(len(self.index) + 1)
+        wealth = self.growth(rows, np.zeros_like(rows))
+        peak = np.maximum.accumulate(wealth, axis=0)
+        dd = wealth[1:] / peak[1:] - 1
+        dd[~self.valid] = np.nan
+        return self._frame(dd)
+
+    def max_drawdown(self):
+        """ Returns the largest drawdown of each column (a negative number or 0). """
+        return self.drawdown().min()
+
+    def sharpe(self, rf=0.0, periods=12):
+        """ Returns the annualised Sharpe ratio of each column.
+
+        Parameters
+        ----------
+        rf : float
+            Risk-free rate per period.
+        periods : int
+            Number of periods per year, 12 for monthly returns.
+        """
+        return np.sqrt(periods) * self._mean(self.ret - rf) / self._std()
+
+    def sortino(self, rf=0.0, periods=12):
+        """ Returns the annualised Sortino ratio of each column: the mean excess return
+        over the root mean square of the negative excess returns. See `sharpe`.
+        """
+        excess = self.ret - rf
+        downside = np.sqrt(self._mean(np.minimum(excess, 0.0) ** 2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(periods) * self._mean(excess) / downside
+
+    def _mean(self, arr):
+        return pd.Series(np.nanmean(np.where(self.valid, arr, np.nan), axis=0), index=self.columns)
+
+    def _std(self):
+        return pd.DataFrame(self.ret, columns=self.columns).std()
+
+    def summary(self, rf=0.0, periods=12):
+        """ Returns a DataFrame with one column per portfolio and the rows
+        - 'cum_ret': buy and hold return over the whole sample;
+        - 'ann_ret': annualised geometric mean return (NaN if the final wealth is not positive);
+        - 'ann_vol': annualised standard deviation;
+        - 'sharpe', 'sortino': see `sharpe` and `sortino`;
+        - 'max_dd': see `max_drawdown`;
+        - 'n_obs': number of non-missing returns.
+        """
+        n_obs = self.count[-1]
+        final = self.growth(np.array([len(self.index)]), np.array([0]))[0]
+        # The geometric mean is undefined if the wealth is lost
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ann_ret = np.where(final > 0, np.expm1(self.log[-1] * periods / n_obs), np.nan)
+        res = pd.DataFrame({
+            'cum_ret': final - 1,
+            'ann_ret': ann_ret,
+            'ann_vol': self._std() * np.sqrt(periods),
+            'sharpe': self.sharpe(rf, periods),
+            'sortino': self.sortino(rf, periods),
+            'max_dd': self.max_drawdown(),
+            'n_obs': n_obs,
+        }, index=self.columns)
+        return res.T.reindex(SUMMARY_ROWS)
+
+
+def perf_summary(df, rf=0.0, periods=12):
+    """ Returns `LogReturns(df).summary(rf, periods)`. """
+    return LogReturns(df).summary(rf, periods)
+
+
+def _test_log_returns():
+    """ Test function for `LogReturns`, using made-up monthly portfolio returns.
+    `cumulative` should match `(1 + df).cumprod() - 1`.
+    """
+    rng = np.random.default_rng(0)
+    idx = pd.period_range('2010-01', '2019-12', freq='M', name='Year_Month')
+    df = pd.DataFrame(rng.normal(0.01, 0.05, (len(idx), 3)), index=idx,
+                      columns=['ewp_rank_1', 'ewp_rank_2', 'ls'])
+    df.iloc[:5, 1] = np.nan
+    lr = LogReturns(df)
+    to_print = [
+        f"max |cumulative - cumprod|: {(lr.cumulative() - ((1 + df).cumprod() - 1)).abs().max().max():.2e}",
+        f"12-month rolling returns:\n{lr.rolling(12).tail(3)}",
+        f"summary:\n{lr.summary()}",
+    ]
+    util.test_print('\n'.join(to_print))
+
+
+if __name__ == "__main__":
+    pass
+    # _test_log_returns()
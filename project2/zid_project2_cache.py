@@ -0,0 +1,188 @@
+""" zid_project2_cache.py
+
+Content-addressed on-disk cache of the `portfolio_main` stages.
+
+`portfolio_main` runs `aj_ret_dict` -> `cha_main` -> `pf_main`. With a
+`StageCache`, each stage's output is stored under a key that is the sha256 of
+    - the stage name,
+    - its parameters (tickers, dates, cha_name, ret_freq_use, q, ...),
+    - the key of the stage that produced its input,
+    - the source code of the modules that compute it, and
+    - for the stage that reads the price files, the name, size and
+      modification time of every file in the data folder (`dir_fingerprint`),
+    - for table arguments such as the eligibility matrix of `pf_main`, a hash
+      of their contents (`frame_fingerprint`),
+so a stage whose key is already stored is loaded instead of run. Changing
+only `q` reruns `pf_main` alone; editing zid_project2_characteristics.py
+reruns `cha_main` and `pf_main`; refreshing a price file (e.g. with
+`yf_prc_refresh` in yf_example2.py) reruns every stage.
+
+Outputs are pickled (binary, highest protocol) to `<cache_dir>/<key>.pkl`.
+When the files exceed `max_bytes`, the least recently used ones are deleted.
+
+    >> cache = StageCache('stage_cache', max_bytes=2 * 1024**3)
+    >> dict_ret, df_cha, df_pf = portfolio_main(tickers, start, end, 'vol', ['Daily',], 3, cache=cache)
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import zid_project2_log as log
+
+logger = log.get_logger('cache')
+
+
+def code_version(modules):
+    """ Returns the sha256 of the source files of `modules`. """
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, 'rb') as file:
+            h.update(file.read())
+    return h.hexdigest()
+
+
+def default_datdir():
+    """ Returns the folder of the ".dat" price files, project1/project1/data. """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(root, 'project1', 'project1', 'data')
+
+
+def dir_fingerprint(pth):
+    """ Returns [[name, size, mtime_ns], ...] of the files in the folder `pth`,
+    sorted by name, or None if the folder does not exist. Any change to a file
+    that updates its size or modification time changes the fingerprint.
+    """
+    if not os.path.isdir(pth):
+        return None
+    res = []
+    for entry in os.scandir(pth):
+        if entry.is_file():
+            stat = entry.stat()
+            res.append([entry.name, stat.st_size, stat.st_mtime_ns])
+    return sorted(res)
+
+
+def frame_fingerprint(df):
+    """ Returns the sha256 of the index, columns and values of the DataFrame `df`,
+    or None if `df` is None, so a table argument can be part of a stage key.
+    """
+    if df is None:
+        return None
+    import pandas as pd
+
+    h = hashlib.sha256()
+    h.update(json.dumps([str(col) for col in df.columns]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def stage_key(name, params, modules=()):
+    """ Returns the cache key of a stage.
+
+    Parameters
+    ----------
+    name : str
+        The stage name, e.g. 'cha_main'.
+    params : dict
+        The stage parameters, including the keys of upstream stages. Values must
+        be JSON-serialisable or have a stable `str`.
+    modules : list
+        The modules whose source code determines the stage output.
+    """
+    payload = json.dumps({'stage': name, 'params': params, 'code': code_version(modules)},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StageCache:
+    """ A size-bounded directory of pickled stage outputs.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache folder. It is created if needed.
+    max_bytes : int
+        The largest total size of the cached files. 1 GB by default.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _pth(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key):
+        """ Returns (True, output) if `key` is stored, else (False, None).
+        A hit marks the entry as recently used.
+        """
+        pth = self._pth(key)
+        try:
+            with open(pth, 'rb') as file:
+                obj = pickle.load(file)
+        except FileNotFoundError:
+            return False, None
+        os.utime(pth)
+        return True, obj
+
+    def put(self, key, obj):
+        """ Stores `obj` under `key`, then evicts entries if the cache is too large.
+        The file is written to a temporary location first and then renamed, so a
+        crash never leaves a half-written entry behind.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._pth(key))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def entries(self):
+        """ Returns [(last use time, size, path), ...] of the cached files, least recently used first. """
+        res = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                res.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(res)
+
+    def evict(self):
+        """ Deletes the least recently used files until the total size is at most `max_bytes`. """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, pth in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(pth)
+            total -= size
+            logger.debug("Evicted %s", pth)
+
+    def clear(self):
+        """ Deletes every cached file. """
+        for _, _, pth in self.entries():
+            os.remove(pth)
+
+
+def run_stage(cache, name, params, func, modules=()):
+    """ Returns (output, key) of a stage, loading the output from `cache` if it is
+    stored there and otherwise computing it with `func()` and storing it.
+
+    If `cache` is None, `func()` is called and the key is None.
+    """
+    if cache is None:
+        return func(), None
+    key = stage_key(name, params, modules)
+    hit, obj = cache.get(key)
+    if hit:
+        logger.info("Stage %s loaded from cache", name)
+        return obj, key
+    obj = func()
+    cache.put(key, obj)
+    return obj, key
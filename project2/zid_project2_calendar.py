@@ -0,0 +1,146 @@
+""" zid_project2_calendar.py
+
+Trading calendar shared by the project2 stages.
+
+`vol_cal` used to group daily returns with `resample('ME')`, `merge_tables`
+converted indexes with `to_datetime(...).to_period('M')` and `get_avg` built
+a year mask with `df.index.year == year`, each time they were called.
+A `TradingCalendar` does this grouping once for the union of trading dates:
+
+    - `month_id`: the month number (0, 1, ...) of each trading day;
+    - `month_start`: day offsets of the months, so the days of month m are
+      positions month_start[m]:month_start[m + 1];
+    - `year_start`: month offsets of the years, in the same way;
+    - `n_days`: the number of trading days in each month.
+
+Build it once, e.g. from the daily return table of `aj_ret_dict`, and pass
+it as `cal` to `cha_main`, `vol_cal`, `merge_tables` and `get_avg`:
+
+    >> cal = TradingCalendar.from_frames(ret['Daily'])
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class TradingCalendar:
+    """ Month and year groupings of a set of trading dates.
+
+    Parameters
+    ----------
+    dates : array-like
+        Trading dates. Duplicates are dropped and the dates are sorted.
+
+    Attributes
+    ----------
+    dates : DatetimeIndex
+        The sorted trading dates, named 'Date'.
+    months : PeriodIndex
+        The year-months with at least one trading date, named 'Year_Month'.
+    month_id : ndarray
+        The position in `months` of each date in `dates`.
+    month_start : ndarray
+        len(months) + 1 day offsets of the months.
+    n_days : ndarray
+        The number of trading dates in each month.
+    years : ndarray
+        The years with at least one trading date.
+    year_start : ndarray
+        len(years) + 1 month offsets of the years.
+    """
+
+    def __init__(self, dates):
+        self.dates = pd.DatetimeIndex(dates).unique().sort_values().rename('Date')
+        month_id, months = pd.factorize(self.dates.to_period('M'), sort=True)
+        self.month_id = month_id
+        self.months = months.rename('Year_Month')
+        self.month_start = np.searchsorted(month_id, np.arange(len(months) + 1))
+        self.n_days = np.diff(self.month_start)
+
+        self.years, year_first = np.unique(self.months.year, return_index=True)
+        self.year_start = np.append(year_first, len(months))
+
+    @classmethod
+    def from_frames(cls, *dfs):
+        """ Builds the calendar from the union of the DatetimeIndex of `dfs`,
+        e.g. the daily return table or the price tables of each stock.
+        """
+        return cls(np.concatenate([df.index.to_numpy() for df in dfs]))
+
+    @classmethod
+    def from_dat_files(cls, pths, date_span=(14, 25)):
+        """ Builds the calendar from the union of dates in the ".dat" price files `pths`.
+
+        Parameters
+        ----------
+        pths : list
+            Locations of the ".dat" files.
+        date_span : tuple
+            The (start, end) character positions of the Date column in each line.
+            The default follows the column layout of the files in project1/data.
+        """
+        dates = [pd.read_fwf(pth, colspecs=[date_span], header=None, dtype=str)[0].str.strip()
+                 for pth in pths]
+        return cls(pd.to_datetime(np.concatenate(dates), format='%Y-%m-%d'))
+
+    @property
+    def n_months(self):
+        return len(self.months)
+
+    def month_ids(self, index):
+        """ Returns the position in `months` of the month of each date of the
+        DatetimeIndex `index`. The dates need not be trading dates (e.g. calendar
+        month-end stamps), only their months must be in the calendar.
+
+        Raises
+        ------
+        ValueError
+            If the month of a date of `index` is not in the calendar.
+        """
+        if index.equals(self.dates):
+            return self.month_id
+        # Months as datetime64[M] values, so the lookup is one binary search
+        month_keys = self.months.to_timestamp().to_numpy().astype('datetime64[M]')
+        keys = pd.DatetimeIndex(index).to_numpy().astype('datetime64[M]')
+        pos = np.searchsorted(month_keys, keys)
+        found = pos < len(month_keys)
+        found[found] = month_keys[pos[found]] == keys[found]
+        if not found.all():
+            raise ValueError("{} dates are in months not in the trading calendar".format((~found).sum()))
+        return pos
+
+    def to_period(self, index):
+        """ Returns `index` as a Monthly frequency PeriodIndex named 'Year_Month',
+        looking the months up instead of converting each date.
+        A PeriodIndex is returned as is.
+        """
+        if isinstance(index, pd.PeriodIndex):
+            return index
+        return self.months[self.month_ids(index)]
+
+    def month_days(self, m):
+        """ Returns the slice of `dates` positions of the m-th month. """
+        return slice(int(self.month_start[m]), int(self.month_start[m + 1]))
+
+    def year_months(self, year):
+        """ Returns the slice of `months` positions of `year` (empty if not in the calendar). """
+        i = np.searchsorted(self.years, year)
+        if i == len(self.years) or self.years[i] != year:
+            return slice(0, 0)
+        return slice(int(self.year_start[i]), int(self.year_start[i + 1]))
+
+    def year_days(self, year):
+        """ Returns the slice of `dates` positions of `year`. """
+        months = self.year_months(year)
+        return slice(int(self.month_start[months.start]), int(self.month_start[months.stop]))
+
+    def year_rows(self, index, year):
+        """ Returns the slice of rows of the sorted DatetimeIndex or PeriodIndex
+        `index` that fall in `year`, with two binary searches for the start of
+        `year` and of the next year. Rows need not be trading dates.
+        """
+        if isinstance(index, pd.PeriodIndex):
+            first, stop = pd.Period(year=year, month=1, freq='M'), pd.Period(year=year + 1, month=1, freq='M')
+        else:
+            first, stop = pd.Timestamp(year, 1, 1), pd.Timestamp(year + 1, 1, 1)
+        return slice(int(index.searchsorted(first, side='left')), int(index.searchsorted(stop, side='left')))
@@ -11,12 +11,19 @@
 
 # <COMPLETE THIS PART>
 
+import sys
 import pandas as pd
 import numpy as np
 import util
 import zid_project2_etl as etl
+import zid_project2_calendar as cd
+import zid_project2_instrument as ins
+import zid_project2_log as log
+import zid_project2_precision as pr
 import config as cfg  # Assuming config.py contains necessary configurations
 
+logger = log.get_logger('cha')
+
 
 
 # ----------------------------------------------------------------------------------------
@@ -29,11 +36,12 @@ def vol_input_sanity_check(ret, cha_name, ret_freq_use: list):
     Performs sanity checks on the inputs provided for calculating stock characteristics.
 
     This function validates the inputs required for characteristic calculation, ensuring they meet specific criteria:
-    - `dic_ret` must be a dictionary containing two keys: "Daily" and "Monthly".
+    - `dic_ret` must be a dictionary containing two keys: "Daily" and "Monthly", and optionally
+       "OHLC" with daily prices for the range-based volatilities (see zid_project2_ohlc.py).
     - `cha_name` must be a string and should correspond to a function name that exists
        for calculating the characteristic.
-    - `ret_freq_use` should be a list containing any combination of "Daily" and "Monthly",
-       or be empty to indicate which return series to be used when construct characteristics.
+    - `ret_freq_use` should be a list containing any combination of "Daily", "Monthly"
+       and "OHLC" (if `ret` has it), or be empty to indicate which return series to be used when construct characteristics.
 
     Parameters
     ----------
@@ -56,9 +64,11 @@ def vol_input_sanity_check(ret, cha_name, ret_freq_use: list):
       with an appropriate error message.
     """
     keys = {"Daily", "Monthly"}
-    # Check if dic_ret is a dictionary with "Daily" and "Monthly" keys
-    if not isinstance(ret, dict) or set(ret.keys()) != keys:
-        return sys.exit("The input file, `ret`, must be a dictionary with two keys: 'Daily' and 'Monthly'.")
+    # Check if dic_ret is a dictionary with "Daily" and "Monthly" keys (and optionally "OHLC")
+    if not isinstance(ret, dict) or set(ret.keys()) - {"OHLC"} != keys:
+        return sys.exit("The input file, `ret`, must be a dictionary with two keys: 'Daily' and 'Monthly'"
+                        " (and optionally 'OHLC').")
+    keys = set(ret.keys())
 
     # Check if cha_name is a string and corresponds to an existing function
     if not isinstance(cha_name, str):
@@ -68,9 +78,10 @@ def vol_input_sanity_check(ret, cha_name, ret_freq_use: list):
     if function_name not in globals() or not callable(globals()[function_name]):
         return sys.exit("{} must be an existing function to calculate the characteristic.".format(function_name))
 
-    # Check if ret_freq_use is a subset of {"Daily", "Monthly"}
+    # Check if ret_freq_use is a subset of {"Daily", "Monthly"} (or "OHLC" if available)
     if not isinstance(ret_freq_use, list) or not set(ret_freq_use).issubset(keys):
-        return sys.exit("`ret_freq_use` must be a list containing 'Daily', 'Monthly', both or blank.")
+        return sys.exit("`ret_freq_use` must be a list containing 'Daily', 'Monthly', both or blank"
+                        " (or 'OHLC' if `ret` has it).")
 
     return util.color_print('Sanity checks for inputs of characteristics script passed.')
 
@@ -78,7 +89,7 @@ def vol_input_sanity_check(ret, cha_name, ret_freq_use: list):
 # ----------------------------------------------------------------------------
 # Part 5.4: Complete the vol_cal function
 # ----------------------------------------------------------------------------
-def vol_cal(ret, cha_name, ret_freq_use: list):
+def vol_cal(ret, cha_name, ret_freq_use: list, cal=None):
     """
     This function calculates the monthly total return volatility for stocks.
     It extracts daily return series, as specified by ret_freq_use, from the input dictionary named `ret`.
@@ -100,6 +111,9 @@ def vol_cal(ret, cha_name, ret_freq_use: list):
     ret_freq_use  :  list
         It identifies that which frequency returns you will use in this function.
         Set it as ['Daily',] when calculating total volatility.
+    cal : TradingCalendar, optional
+        The trading calendar of the daily returns (see zid_project2_calendar.py).
+        If given, days are grouped by its precomputed month ids instead of resampling.
 
     Returns
     -------
@@ -113,6 +127,9 @@ def vol_cal(ret, cha_name, ret_freq_use: list):
 
         - df.index: Monthly frequency PeriodIndex with name of 'Year_Month'
 
+        The values have the dtype of the daily returns. For float32 returns the
+        variance sums are accumulated in float64, see `grouped_std` in zid_project2_precision.py.
+
     Note: Please delete rows with **ALL** NaN value. Read pandas.DataFrame.dropna method documentation.
 
     Examples:
@@ -154,34 +171,96 @@ def vol_cal(ret, cha_name, ret_freq_use: list):
     """
 
     # <COMPLETE THIS PART>
-def vol_cal(ret, cha_name, ret_freq_use: list):
+@ins.timed('vol_cal')
+def vol_cal(ret, cha_name, ret_freq_use: list, cal=None):
     if 'Daily' in ret_freq_use:
         data = ret['Daily']
     else:
         raise ValueError("Unsupported return frequency. Please include 'Daily' in ret_freq_use.")
 
-    vol_data = data.resample('ME').std()
-    print("Volatility data:", vol_data.head())
-
-    count_data = data.resample('ME').count()
-    print("Count data:", count_data.head())
+    if cal is not None or (data.dtypes == np.float32).all():
+        # Group by the calendar's month ids; the variance sums accumulate in float64
+        if cal is None:
+            cal = cd.TradingCalendar(data.index)
+        std, count = pr.grouped_std(data.to_numpy(), cal.month_ids(data.index), cal.n_months)
+        vol_data = pd.DataFrame(std, index=cal.months, columns=data.columns)
+        count_data = pd.DataFrame(count, index=cal.months, columns=data.columns)
+    else:
+        vol_data = data.resample('ME').std()
+        count_data = data.resample('ME').count()
+    logger.debug("Volatility data:\n%s", vol_data.head())
+    logger.debug("Count data:\n%s", count_data.head())
 
     vol_data[count_data < 18] = None
 
     vol_data.columns = [f"{col}_{cha_name}" for col in vol_data.columns]
 
     vol_data.dropna(how='all', inplace=True)
-    print("Final volatility data:", vol_data.head())
+    logger.debug("Final volatility data:\n%s", vol_data.head())
 
-    vol_data.index = vol_data.index.to_period('M')
+    if not isinstance(vol_data.index, pd.PeriodIndex):
+        vol_data.index = vol_data.index.to_period('M')
 
     return vol_data
 
 
+# ----------------------------------------------------------------------------
+# Range-based volatilities from daily Open, High, (Low) and Close prices
+# ----------------------------------------------------------------------------
+def _ohlc_vol(ret, cha_name, ret_freq_use, estimator, cal=None):
+    """ Returns the monthly range-based volatility `estimator` (see zid_project2_ohlc.py)
+    from the prices in `ret['OHLC']`, with the same layout as the output of `vol_cal`.
+    """
+    if 'OHLC' not in ret_freq_use or 'OHLC' not in ret:
+        raise ValueError("Range-based volatility needs the 'OHLC' prices in `ret` and in ret_freq_use.")
+    import zid_project2_ohlc as oh
+    df = oh.ohlc_vol(ret['OHLC'], estimator, cha_name, cal)
+    logger.debug("Range-based volatility data:\n%s", df.head())
+    return df
+
+
+@ins.timed('rsuvol_cal')
+def rsuvol_cal(ret, cha_name, ret_freq_use: list, cal=None):
+    """ Monthly volatility from the doubled upper half of the Rogers-Satchell estimator,
+    which needs Open, High and Close only. Set `ret_freq_use` to ['OHLC',].
+    """
+    return _ohlc_vol(ret, cha_name, ret_freq_use, 'rsu', cal)
+
+
+@ins.timed('hivol_cal')
+def hivol_cal(ret, cha_name, ret_freq_use: list, cal=None):
+    """ Monthly volatility from the squared upper range ln(High / Open). Set `ret_freq_use` to ['OHLC',]. """
+    return _ohlc_vol(ret, cha_name, ret_freq_use, 'hi', cal)
+
+
+@ins.timed('ocvol_cal')
+def ocvol_cal(ret, cha_name, ret_freq_use: list, cal=None):
+    """ Monthly volatility from open-to-close returns. Set `ret_freq_use` to ['OHLC',]. """
+    return _ohlc_vol(ret, cha_name, ret_freq_use, 'oc', cal)
+
+
+@ins.timed('pkvol_cal')
+def pkvol_cal(ret, cha_name, ret_freq_use: list, cal=None):
+    """ Monthly Parkinson volatility. Needs 'High' and 'Low' in `ret['OHLC']`. """
+    return _ohlc_vol(ret, cha_name, ret_freq_use, 'pk', cal)
+
+
+@ins.timed('gkvol_cal')
+def gkvol_cal(ret, cha_name, ret_freq_use: list, cal=None):
+    """ Monthly Garman-Klass volatility. Needs 'Open', 'High', 'Low' and 'Close' in `ret['OHLC']`. """
+    return _ohlc_vol(ret, cha_name, ret_freq_use, 'gk', cal)
+
+
+@ins.timed('rsvol_cal')
+def rsvol_cal(ret, cha_name, ret_freq_use: list, cal=None):
+    """ Monthly Rogers-Satchell volatility. Needs 'Open', 'High', 'Low' and 'Close' in `ret['OHLC']`. """
+    return _ohlc_vol(ret, cha_name, ret_freq_use, 'rs', cal)
+
+
 # ----------------------------------------------------------------------------
 # Part 5.5: Complete the merge_tables function
 # ----------------------------------------------------------------------------
-def merge_tables(ret, df_cha, cha_name):
+def merge_tables(ret, df_cha, cha_name, cal=None):
     """ This function merges `ret` and `df_cha` tables.
     It extracts stock monthly returns df from dictionary, `dic`, and left merge it with
     a DataFrame containing values of stock characteristics, 'df_cha'. Then, it shifts
@@ -200,7 +279,11 @@ def merge_tables(ret, df_cha, cha_name):
         See the docstring of the `vol_cal` function in this script for a description of this dataframe.
     cha_name  :  str
         It is the name of the characteristic being calculated.
-        Set it as 'vol' when calculating total volatility.
+        Set it as 'vol' when calculating total volatility. A tuple of column
+        suffixes can be given for a table with several characteristics.
+    cal : TradingCalendar, optional
+        If given, DatetimeIndex tables are converted to year-months with its
+        precomputed month lookup, see zid_project2_calendar.py.
 
     Returns
     -------
@@ -249,12 +332,16 @@ def merge_tables(ret, df_cha, cha_name):
      - Read shift() documentations to understand how to shift the values of a DataFrame along a specified axis
     """
     # <COMPLETE THIS PART>
-def merge_tables(ret, df_cha, cha_name):
+@ins.timed('merge_tables')
+def merge_tables(ret, df_cha, cha_name, cal=None):
     monthly_returns = ret['Monthly'].copy()
 
-    print("Monthly Returns Index:", monthly_returns.index)
-    print("Characteristics Index:", df_cha.index)
+    logger.debug("Monthly Returns Index: %s", monthly_returns.index)
+    logger.debug("Characteristics Index: %s", df_cha.index)
 
+    if cal is not None:
+        monthly_returns.index = cal.to_period(monthly_returns.index)
+        df_cha.index = cal.to_period(df_cha.index)
     if not isinstance(monthly_returns.index, pd.PeriodIndex):
         monthly_returns.index = pd.to_datetime(monthly_returns.index).to_period('M')
     if not isinstance(df_cha.index, pd.PeriodIndex):
@@ -266,7 +353,7 @@ def merge_tables(ret, df_cha, cha_name):
     for col in feature_columns:
         merged_df[col] = merged_df[col].shift(1)
 
-    print("Merged DataFrame:", merged_df.head())
+    logger.debug("Merged DataFrame:\n%s", merged_df.head())
 
     return merged_df
 
@@ -274,7 +361,7 @@ def merge_tables(ret, df_cha, cha_name):
 # ------------------------------------------------------------------------------------
 # Part 5.2: Read the cha_main function and understand the workflow in this script
 # ------------------------------------------------------------------------------------
-def cha_main(ret, cha_name, ret_freq_use: list):
+def cha_main(ret, cha_name, ret_freq_use: list, precision='float64', cal=None):
     """Function to show work flow. This script is to calculate stock total volatility
        using daily return table and merge it with monthly return table.
 
@@ -298,6 +385,15 @@ def cha_main(ret, cha_name, ret_freq_use: list):
         It identifies that which frequency returns you will use in this function.
         Set it as ['Daily',] when calculating stock total volatility here.
 
+    precision  :  str
+        'float64' (the default) or 'float32'. The return tables are cast to this dtype
+        before the characteristic is calculated, so the output is stored in it too.
+        See zid_project2_precision.py.
+
+    cal  :  TradingCalendar, optional
+        The trading calendar of the daily returns, passed to the `*_cal` function
+        and `merge_tables`. See zid_project2_calendar.py.
+
     Returns
     -------
     df
@@ -319,6 +415,47 @@ def cha_main(ret, cha_name, ret_freq_use: list):
         in the module with appropriate logic to handle the inputs and outputs as described.
     """
     # <COMPLETE THIS PART>
+    vol_input_sanity_check(ret, cha_name, ret_freq_use)
+    ret = pr.cast_ret_dict(ret, precision)
+
+    df_cha = globals()['{}_cal'.format(cha_name)](ret, cha_name, ret_freq_use, cal=cal)
+
+    df_cha_f = merge_tables(ret, df_cha, cha_name, cal)
+
+    util.color_print('characteristics script done')
+    return df_cha_f
+
+
+# Range-based volatility characteristics and their estimators in zid_project2_ohlc.py
+OHLC_CHA = {'pkvol': 'pk', 'gkvol': 'gk', 'rsvol': 'rs', 'rsuvol': 'rsu', 'hivol': 'hi', 'ocvol': 'oc'}
+
+
+def ohlc_cha_main(ret, cha_names, precision='float64', cal=None):
+    """ Same as `cha_main` with ret_freq_use=['OHLC',], for several range-based
+    volatilities (keys of `OHLC_CHA`) at once: the log prices are taken once and
+    the monthly averages of all estimators come from one grouped pass, see
+    `ohlc_vols` in zid_project2_ohlc.py.
+
+    Returns
+    -------
+    df
+        The `merge_tables` layout with one `<tic>_<cha_name>` column per
+        characteristic, e.g. the input of `df_reshape_multi` in zid_project2_sorts.py.
+    """
+    import zid_project2_ohlc as oh
+    for cha_name in cha_names:
+        vol_input_sanity_check(ret, cha_name, ['OHLC', ])
+    unknown = [cha_name for cha_name in cha_names if cha_name not in OHLC_CHA]
+    if unknown:
+        raise ValueError("{} are not range-based volatilities, use {}".format(unknown, list(OHLC_CHA)))
+    ret = pr.cast_ret_dict(ret, precision)
+
+    dfs = oh.ohlc_vols(ret['OHLC'], {cha_name: OHLC_CHA[cha_name] for cha_name in cha_names}, cal)
+    df_cha = pd.concat(list(dfs.values()), axis=1)
+    df_cha_f = merge_tables(ret, df_cha, tuple('_{}'.format(cha_name) for cha_name in cha_names), cal)
+
+    util.color_print('characteristics script done')
+    return df_cha_f
 
 
 def check_data_sanity (data):
@@ -0,0 +1,117 @@
+""" zid_project2_cli.py
+
+Command-line entry point of project 2.
+
+Only the standard library is imported when this module loads; pandas, numpy
+and the project 2 modules are imported inside the command that needs them,
+so `--help` and `bench-import` start without paying for them.
+
+    python zid_project2_cli.py portfolio AAPL TSLA V --start 2010-01-01 --end 2020-12-31 --q 3
+    python zid_project2_cli.py bench-import --budget 0.2
+
+`bench-import` times `import <module>` in fresh interpreters for this entry
+point and the pipeline modules, and exits with status 1 if the fastest of
+`--repeat` runs of any module takes more than `--budget` seconds longer than
+importing the `--baseline` modules (numpy and pandas, which every pipeline
+module needs). It guards against project modules that import optional stages
+or do work at import time. Since every pipeline module imports pandas at top
+level, the default baseline hides the pandas import itself: the excess only
+measures the project code, not the full cold start of the pipeline. Use
+`--baseline ''` for the absolute times.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Cold-start budget of a module beyond the baseline imports, in seconds
+IMPORT_BUDGET = 0.2
+BENCH_MODULES = ['zid_project2_cli', 'zid_project2_main', 'zid_project2_portfolio']
+BENCH_BASELINE = 'numpy, pandas'
+
+
+def cmd_portfolio(args):
+    """ Runs `portfolio_main` and prints (or saves) the portfolio returns. """
+    import zid_project2_main as main
+    import zid_project2_cache as sc
+
+    cache = None if args.cache_dir is None else sc.StageCache(args.cache_dir)
+    _, _, df_pf = main.portfolio_main(args.tickers, args.start, args.end, args.cha_name, args.ret_freq_use,
+                                      args.q, precision=args.precision, cache=cache)
+    if args.out is None:
+        print(df_pf.to_string())
+    else:
+        df_pf.to_csv(args.out)
+    return 0
+
+
+def import_time(module, repeat=3):
+    """ Returns the fastest wall time, in seconds, of `python -c "import <module>"`
+    over `repeat` fresh interpreters started in this folder. Interpreter start-up
+    is included.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [HERE, os.environ.get('PYTHONPATH')])))
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import {}'.format(module)], cwd=HERE, env=env, check=True)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def cmd_bench_import(args):
+    """ Prints the import time of each module, and its excess over the baseline
+    imports, and returns 1 if an excess is over budget.
+    """
+    base = import_time(args.baseline, args.repeat) if args.baseline else 0.0
+    print('{:<32s}{:8.3f} s'.format(args.baseline or '(no baseline)', base))
+    status = 0
+    for module in args.modules:
+        sec = import_time(module, args.repeat)
+        over = sec - base > args.budget
+        status = status or int(over)
+        print('{:<32s}{:8.3f} s  {:+.3f} s{}'.format(module, sec, sec - base, '  OVER BUDGET' if over else ''))
+    return status
+
+
+def build_parser():
+    """ Returns the argument parser of the command-line interface. """
+    parser = argparse.ArgumentParser(prog='zid_project2_cli', description='Project 2 portfolio tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('portfolio', help='Construct characteristic-sorted portfolios')
+    p.add_argument('tickers', nargs='+')
+    p.add_argument('--start', required=True)
+    p.add_argument('--end', required=True)
+    p.add_argument('--cha-name', dest='cha_name', default='vol')
+    p.add_argument('--ret-freq-use', dest='ret_freq_use', nargs='+', default=['Daily'])
+    p.add_argument('--q', type=int, default=3)
+    p.add_argument('--precision', choices=['float64', 'float32'], default='float64')
+    p.add_argument('--cache-dir', dest='cache_dir', help='Folder of the stage cache (no caching if omitted)')
+    p.add_argument('--out', help='CSV file for the portfolio returns (printed if omitted)')
+    p.set_defaults(func=cmd_portfolio)
+
+    b = sub.add_parser('bench-import', help='Time module imports in fresh interpreters')
+    b.add_argument('--modules', nargs='+', default=BENCH_MODULES)
+    b.add_argument('--budget', type=float, default=IMPORT_BUDGET,
+                   help='Seconds allowed beyond the baseline import time')
+    b.add_argument('--baseline', default=BENCH_BASELINE,
+                   help="Modules imported by the baseline run. The pipeline modules import numpy and "
+                        "pandas at top level, so the default excludes their cost from the budget "
+                        "('' for an absolute budget)")
+    b.add_argument('--repeat', type=int, default=3)
+    b.set_defaults(func=cmd_bench_import)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+""" zid_project2_factors.py
+
+Factor-model alphas of the portfolio return series.
+
+Factor returns are read from local CSV files in the format of the Kenneth
+French data library (e.g. "F-F_Research_Data_Factors.CSV" and
+"F-F_Momentum_Factor.CSV" saved in a data folder): a few lines of text, a
+header row starting with a comma, monthly rows with a YYYYMM date and
+returns in percent, then annual rows, which are ignored.
+
+Each portfolio column of the `pf_main` output is regressed on the factors of
+a model over the months both are available:
+
+    r_p,t = alpha_p + beta_p' f_t + e_p,t
+
+where r_p,t is the excess return (return minus 'RF') of the quantile
+portfolios and the raw return of the long-short ('ls*') portfolios, which
+are zero-cost. All columns share the regressors, so their coefficients come
+from one multi-output `np.linalg.lstsq` call. t-statistics use
+heteroskedasticity and autocorrelation consistent (Newey-West) standard
+errors, see `long_run_cov` in zid_project2_fmb.py.
+
+    >> df_ff = load_factors(['data/F-F_Research_Data_Factors.CSV', 'data/F-F_Momentum_Factor.CSV'])
+    >> df_pf = pf.pf_main(df_cha, 'vol', 3)
+    >> res = factor_alphas(df_pf, df_ff, 'ff3')
+"""
+
+import io
+
+import numpy as np
+import pandas as pd
+import util
+import zid_project2_fmb as fm
+
+# Factor columns of each model, as named in the French data library files
+FACTOR_MODELS = {
+    'capm': ['Mkt-RF'],
+    'ff3': ['Mkt-RF', 'SMB', 'HML'],
+    'carhart': ['Mkt-RF', 'SMB', 'HML', 'Mom'],
+    'ff5': ['Mkt-RF', 'SMB', 'HML', 'RMW', 'CMA'],
+}
+
+
+def read_ff_csv(pth):
+    """ Returns the monthly section of a French data library CSV file as a DataFrame
+    of decimal returns with a Monthly frequency PeriodIndex named 'Year_Month'.
+    Column names are stripped of spaces.
+    """
+    with open(pth) as file:
+        lines = file.read().splitlines()
+
+    # The monthly block is the header row (starting with a comma) followed by
+    # rows with a 6-digit date, up to the first other row
+    header = next(i for i, line in enumerate(lines) if line.startswith(',') and
+                  i + 1 < len(lines) and lines[i + 1].split(',')[0].strip().isdigit())
+    end = header + 1
+    while end < len(lines) and len(lines[end].split(',')[0].strip()) == 6 and lines[end].split(',')[0].strip().isdigit():
+        end += 1
+
+    df = pd.read_csv(io.StringIO('\n'.join(lines[header:end])), index_col=0, skipinitialspace=True)
+    df.columns = [col.strip() for col in df.columns]
+    df.index = pd.PeriodIndex(df.index.astype(str), freq='M', name='Year_Month')
+    # Missing values are coded as -99.99 (or -999)
+    return df.where(df > -99).astype(float) / 100
+
+
+def load_factors(pths):
+    """ Returns the factors of several French data library CSV files side by side,
+    over the months all of them cover. Columns in more than one file (e.g. 'RF')
+    are kept once.
+    """
+    df = None
+    for pth in pths:
+        df_pth = read_ff_csv(pth)
+        df = df_pth if df is None else df.join(df_pth.drop(columns=df.columns, errors='ignore'), how='inner')
+    return df
+
+
+def align_factors(df_pf, df_factors, factors, rf_col='RF', zero_cost=None):
+    """ Returns (Y, X) aligned on the months where every portfolio and factor is
+    available: Y holds the portfolio returns in excess of `rf_col` (raw returns
+    for the `zero_cost` columns, by default the ones starting with 'ls') and X the factors.
+
+    Raises
+    ------
+    ValueError
+        If a factor is not in `df_factors` or no month is left.
+    """
+    missing = [f for f in list(factors) + [rf_col] if f not in df_factors.columns]
+    if missing:
+        raise ValueError("Factors {} are not in the factor table".format(missing))
+    zero_cost = [col for col in df_pf.columns if col.startswith('ls')] if zero_cost is None else zero_cost
+
+    df = df_pf.join(df_factors, how='inner', rsuffix='_factor').dropna(subset=list(df_pf.columns) + list(factors) + [rf_col])
+    if df.empty:
+        raise ValueError("The portfolio and factor returns have no month in common")
+    excess = [col for col in df_pf.columns if col not in zero_cost]
+    Y = df[list(df_pf.columns)].astype(float)
+    Y[excess] = Y[excess].sub(df[rf_col], axis=0)
+    return Y, df[list(factors)].astype(float)
+
+
+def factor_alphas(df_pf, df_factors, model='ff3', rf_col='RF', zero_cost=None, lags=None):
+    """
+    Estimates the alpha and factor betas of every portfolio column.
+
+    Parameters
+    ----------
+    df_pf : df
+        Portfolio returns with a Monthly frequency PeriodIndex, e.g. the output of `pf_main`.
+    df_factors : df
+        Factor returns with a Monthly frequency PeriodIndex, e.g. the output of `load_factors`.
+    model : str or list
+        A key of `FACTOR_MODELS` or a list of factor columns.
+    rf_col : str
+        The risk-free rate column of `df_factors`.
+    zero_cost : list, optional
+        Portfolio columns not in excess of the risk-free rate. If None, the
+        columns whose name starts with 'ls'.
+    lags : int, optional
+        Newey-West lags. If None, `nw_lags(T)` in zid_project2_fmb.py.
+
+    Returns
+    -------
+    df
+        One row per portfolio column, with columns 'alpha', 't_alpha', then
+        '<factor>' (the beta) and 't_<factor>' for each factor, 'r2' and 'n_months'.
+        Alphas are monthly, in decimal.
+    """
+    factors = FACTOR_MODELS[model] if isinstance(model, str) else list(model)
+    Y, F = align_factors(df_pf, df_factors, factors, rf_col, zero_cost)
+    y = Y.to_numpy()
+    X = np.column_stack([np.ones(len(F)), F.to_numpy()])
+    n_obs, n_x = X.shape
+
+    # One least-squares solve for all portfolios: coef is (K + 1) x P
+    coef, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    resid = y - X @ coef
+
+    # HAC covariance of each portfolio's coefficients: T (X'X)^-1 S_p (X'X)^-1
+    xtx_inv = np.linalg.inv(X.T @ X)
+    scores = X[None, :, :] * resid.T[:, :, None]
+    cov = n_obs * xtx_inv @ fm.long_run_cov(scores, lags) @ xtx_inv
+    se = np.sqrt(np.diagonal(cov, axis1=-2, axis2=-1))
+
+    res = {}
+    for j, name in enumerate(['alpha'] + factors):
+        res[name] = coef[j]
+        res['t_alpha' if j == 0 else 't_{}'.format(name)] = coef[j] / se[:, j]
+    res['r2'] = 1 - (resid ** 2).sum(axis=0) / ((y - y.mean(axis=0)) ** 2).sum(axis=0)
+    res['n_months'] = n_obs
+    cols = ['alpha', 't_alpha'] + [c for f in factors for c in (f, 't_{}'.format(f))] + ['r2', 'n_months']
+    df_res = pd.DataFrame(res, index=Y.columns)[cols]
+
+    util.color_print('factor_alphas function done')
+    return df_res
+
+
+def _test_factor_alphas():
+    """ Test function for `factor_alphas`, using made-up factor and portfolio returns
+    with known alphas and betas.
+    """
+    rng = np.random.default_rng(0)
+    idx = pd.period_range('2000-01', periods=240, freq='M', name='Year_Month')
+    df_ff = pd.DataFrame(rng.normal(0.005, 0.04, (240, 3)), index=idx, columns=FACTOR_MODELS['ff3'])
+    df_ff['RF'] = 0.002
+    beta = np.array([[1.0, 0.5, 0.2], [1.2, 0.8, -0.1]])
+    ret = df_ff[FACTOR_MODELS['ff3']].to_numpy() @ beta.T + [0.001, 0.004] + rng.normal(0, 0.01, (240, 2))
+    df_pf = pd.DataFrame(ret, index=idx, columns=['ewp_rank_1', 'ewp_rank_2']) + 0.002
+    df_pf['ls'] = df_pf['ewp_rank_2'] - df_pf['ewp_rank_1']
+
+    res = factor_alphas(df_pf, df_ff, 'ff3')
+    util.test_print(res.round(4), "This means `factor_alphas(df_pf, df_ff, 'ff3')`, true alphas 0.001, 0.004, 0.003:")
+
+
+if __name__ == "__main__":
+    pass
+    # _test_factor_alphas()
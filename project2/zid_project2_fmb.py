@@ -0,0 +1,204 @@
+""" zid_project2_fmb.py
+
+Fama-MacBeth regressions of monthly returns on lagged characteristics.
+
+Each year-month t, the returns of the stocks are regressed on their
+characteristics from t-1 (the layout of the `cha_main` output):
+
+    Ret_i,t = a_t + b_t' X_i,t-1 + e_i,t
+
+and the estimate of each coefficient is the time-series average of its
+monthly slopes, with a Newey-West standard error.
+
+All monthly regressions are solved in one batched computation. The rows of
+every month are demeaned by their month means (the slopes of a regression
+with an intercept do not change), the per-month normal equations
+X'X and X'y are accumulated with one `np.bincount` per matrix element, and
+the stack of K x K systems is solved with one `np.linalg.solve` call.
+Sums are accumulated in float64.
+
+    >> df_cha = cha.cha_main(ret, 'vol', ['Daily',])
+    >> res, slopes = fm_main(df_cha, ['vol'])
+"""
+
+import numpy as np
+import pandas as pd
+import util
+import zid_project2_instrument as ins
+import zid_project2_sorts as so
+
+
+def nw_lags(n_obs):
+    """ Returns the Newey-West (1994) rule-of-thumb lag length, floor(4 (T / 100)^(2/9)). """
+    return int(np.floor(4 * (n_obs / 100) ** (2 / 9)))
+
+
+def long_run_cov(scores, lags=None):
+    """ Returns the Newey-West estimate of the long-run covariance of the columns of `scores`.
+
+    Parameters
+    ----------
+    scores : ndarray
+        (T x K) array of mean-zero observations (e.g. demeaned slopes or
+        regression scores x_t * u_t), without NaN, or a stack (... x T x K)
+        of such arrays.
+    lags : int, optional
+        The number of lags with Bartlett weights 1 - l / (lags + 1).
+        If None, `nw_lags(T)`.
+
+    Returns
+    -------
+    ndarray
+        The K x K matrix  G_0 + sum_l w_l (G_l + G_l'),  where G_l = sum_t s_t s_t-l' / T
+        (one per array of a stack).
+    """
+    n_obs = scores.shape[-2]
+    lags = nw_lags(n_obs) if lags is None else lags
+    s_t = np.swapaxes(scores, -1, -2)
+    cov = s_t @ scores / n_obs
+    for lag in range(1, min(lags, n_obs - 1) + 1):
+        gamma = s_t[..., lag:] @ scores[..., :-lag, :] / n_obs
+        cov += (1 - lag / (lags + 1)) * (gamma + np.swapaxes(gamma, -1, -2))
+    return cov
+
+
+def grouped_ols(y, X, codes, n_groups, min_obs=None):
+    """ Solves the OLS regression of `y` on `X` and an intercept within each group.
+
+    Parameters
+    ----------
+    y : ndarray
+        (n,) dependent variable, without NaN.
+    X : ndarray
+        (n x K) regressors, without NaN and without a constant column.
+    codes : ndarray
+        Group (e.g. year-month) code of each row, in range(n_groups).
+    n_groups : int
+        Number of groups.
+    min_obs : int, optional
+        Groups with fewer rows get NaN coefficients. Defaults to K + 2.
+
+    Returns
+    -------
+    tuple
+        (coef, count): coef is a (n_groups x (K + 1)) array of the intercept and
+        the K slopes of each group, NaN where a group has too few rows or
+        collinear regressors; count is the number of rows of each group.
+    """
+    n_x = X.shape[1]
+    min_obs = n_x + 2 if min_obs is None else min_obs
+    X = X.astype(np.float64)
+    y = y.astype(np.float64)
+
+    count = np.bincount(codes, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.column_stack([np.bincount(codes, weights=X[:, j], minlength=n_groups)
+                                  for j in range(n_x)]) / count[:, None]
+        y_mean = np.bincount(codes, weights=y, minlength=n_groups) / count
+    Xd = X - x_mean[codes]
+    yd = y - y_mean[codes]
+
+    # Per-group X'X (symmetric, so only the upper triangle is accumulated) and X'y
+    xtx = np.empty((n_groups, n_x, n_x))
+    for i in range(n_x):
+        for j in range(i, n_x):
+            xtx[:, i, j] = xtx[:, j, i] = np.bincount(codes, weights=Xd[:, i] * Xd[:, j], minlength=n_groups)
+    xty = np.column_stack([np.bincount(codes, weights=Xd[:, j] * yd, minlength=n_groups) for j in range(n_x)])
+
+    # Groups with too few rows or (near-)singular X'X are left as NaN
+    ok = count >= min_obs
+    ok[ok] = np.linalg.matrix_rank(xtx[ok]) == n_x
+    coef = np.full((n_groups, n_x + 1), np.nan)
+    if ok.any():
+        slopes = np.linalg.solve(xtx[ok], xty[ok][..., None])[..., 0]
+        coef[ok, 1:] = slopes
+        coef[ok, 0] = y_mean[ok] - np.einsum('gk,gk->g', x_mean[ok], slopes)
+    return coef, count
+
+
+@ins.timed('fama_macbeth')
+def fama_macbeth(df_long, x_cols, y_col='Ret', lags=None, min_obs=None):
+    """
+    Runs Fama-MacBeth regressions on a long panel.
+
+    Parameters
+    ----------
+    df_long : df
+        A long table with a Monthly frequency PeriodIndex, e.g. the output of
+        `df_reshape_multi` in zid_project2_sorts.py. Rows missing `y_col` or any
+        of `x_cols` are dropped.
+    x_cols : list
+        The characteristic columns (the regressors).
+    y_col : str
+        The dependent variable, 'Ret' by default.
+    lags : int, optional
+        Newey-West lags of the standard errors. If None, `nw_lags(n_months)`.
+    min_obs : int, optional
+        The fewest stocks for a monthly regression, see `grouped_ols`.
+
+    Returns
+    -------
+    tuple
+        (res, slopes):
+        - res: a DataFrame indexed by 'const' and `x_cols`, with columns 'coef'
+          (average slope), 'se' (Newey-West standard error), 'tstat' and 'n_months';
+        - slopes: a DataFrame of the monthly coefficients with the same columns
+          as `res.index` plus 'n_obs', and a Monthly frequency PeriodIndex
+          (months without a regression are dropped).
+    """
+    df = df_long.dropna(subset=[y_col] + list(x_cols))
+    month_codes, months = pd.factorize(df.index, sort=True)
+    coef, count = grouped_ols(df[y_col].to_numpy(), df[list(x_cols)].to_numpy(), month_codes, len(months), min_obs)
+
+    names = ['const'] + list(x_cols)
+    slopes = pd.DataFrame(coef, index=pd.PeriodIndex(months, name=df_long.index.name), columns=names)
+    slopes['n_obs'] = count
+    slopes = slopes.dropna(subset=names)
+
+    b = slopes[names].to_numpy()
+    n_months = len(b)
+    mean = b.mean(axis=0)
+    cov = long_run_cov(b - mean, lags) / n_months
+    se = np.sqrt(np.diag(cov))
+    res = pd.DataFrame({'coef': mean, 'se': se, 'tstat': mean / se, 'n_months': n_months}, index=names)
+
+    util.color_print('fama_macbeth function done')
+    return res, slopes
+
+
+def fm_main(df_cha, cha_names, lags=None, min_obs=None):
+    """
+    Runs Fama-MacBeth regressions of monthly returns on lagged characteristics
+    from a wide characteristic table (the output of `cha_main`, or several of them
+    combined, see `df_reshape_multi` in zid_project2_sorts.py).
+
+    Returns
+    -------
+    tuple
+        The output of `fama_macbeth`.
+    """
+    df_long = so.df_reshape_multi(df_cha, cha_names)
+    return fama_macbeth(df_long, cha_names, lags=lags, min_obs=min_obs)
+
+
+def _test_fama_macbeth(n_months=240, n_stocks=500):
+    """ Test function for `fama_macbeth`, using made-up data. The monthly
+    coefficients are compared with a loop of `np.linalg.lstsq` calls.
+    """
+    rng = np.random.default_rng(0)
+    idx = pd.PeriodIndex(np.repeat(pd.period_range('2000-01', periods=n_months, freq='M'), n_stocks),
+                         name='Year_Month')
+    x = rng.normal(size=(len(idx), 2))
+    ret = 0.01 + x @ np.array([0.002, -0.001]) + rng.normal(0, 0.05, len(idx))
+    df = pd.DataFrame({'Ret': ret, 'vol': x[:, 0], 'size': x[:, 1]}, index=idx)
+
+    res, slopes = fama_macbeth(df, ['vol', 'size'])
+    loop = [np.linalg.lstsq(np.column_stack([np.ones(len(g)), g[['vol', 'size']]]), g['Ret'], rcond=None)[0]
+            for _, g in df.groupby(level=0)]
+    diff = np.abs(slopes[['const', 'vol', 'size']].to_numpy() - np.array(loop)).max()
+    util.test_print(res, "This means `fama_macbeth(df, ['vol', 'size'])[0]`, max diff vs lstsq: {}".format(diff))
+
+
+if __name__ == "__main__":
+    pass
+    # _test_fama_macbeth()
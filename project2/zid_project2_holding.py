@@ -0,0 +1,180 @@
+""" zid_project2_holding.py
+
+Rebalancing-frequency and holding-period engine.
+
+`pf_main` forms portfolios every month and holds them for one month. This module
+reuses one set of monthly rank assignments (the output of `stock_sorting`) to build
+    - portfolios rebalanced quarterly or annually, and
+    - Jegadeesh-Titman style overlapping portfolios held for K months, where the
+      return in a month is the average of the K cohorts formed in the K previous
+      formation months.
+
+The ranks are pivoted once into a (year-month x ticker) matrix. The cohort formed
+k months ago is that matrix shifted down k rows; its bucket returns are computed
+for all months and buckets at once with `np.bincount`. Averaging the K shifted
+results gives the overlapping portfolio returns without re-running `pf_main`.
+"""
+
+import pandas as pd
+import numpy as np
+import util
+import zid_project2_instrument as ins
+import zid_project2_portfolio as pf
+
+# Formation months for each rebalancing frequency
+REBALANCE_MONTHS = {
+    'M': tuple(range(1, 13)),
+    'Q': (3, 6, 9, 12),
+    'A': (12,),
+}
+
+
+def formation_mask(index, rebalance='M'):
+    """ Returns a boolean array marking the year-months whose ranks come from a
+    formation date.
+
+    The rank in year-month t is based on the characteristic at the end of t-1
+    (see `merge_tables`), so t is a formation row when t-1 is a rebalancing month.
+
+    Parameters
+    ----------
+    index : PeriodIndex
+        Monthly frequency PeriodIndex.
+    rebalance : str
+        'M' (monthly), 'Q' (at the end of each quarter), or 'A' (at the end of each year).
+    """
+    if rebalance not in REBALANCE_MONTHS:
+        raise ValueError("`rebalance` must be one of {}".format(list(REBALANCE_MONTHS)))
+    return np.isin((index - 1).month, REBALANCE_MONTHS[rebalance])
+
+
+def rank_matrix(df_sorted, index, tickers):
+    """ Pivots the 'rank' column of `df_sorted` into a (year-month x ticker) array,
+    with NaN where a stock has no rank.
+    """
+    ranks = df_sorted.pivot_table(index=df_sorted.index, columns='ticker', values='rank', observed=True)
+    return ranks.reindex(index=index, columns=tickers).to_numpy(dtype=float, copy=True)
+
+
+def bucket_returns(ret, ranks, q):
+    """ Returns the equal-weighted return of each bucket in each row.
+
+    Parameters
+    ----------
+    ret : ndarray
+        (T x N) stock returns.
+    ranks : ndarray
+        (T x N) bucket of each stock (0, ..., q-1), NaN if the stock is not held.
+    q : int
+        Number of buckets.
+
+    Returns
+    -------
+    ndarray
+        (T x q) bucket returns, NaN where a bucket holds no stock with a return.
+    """
+    n_rows = ret.shape[0]
+    held = ~np.isnan(ranks) & ~np.isnan(ret)
+    rows = np.broadcast_to(np.arange(n_rows)[:, None], ret.shape)[held]
+    cells = rows * q + ranks[held].astype(int)
+    sums = np.bincount(cells, weights=ret[held], minlength=n_rows * q)
+    counts = np.bincount(cells, minlength=n_rows * q)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums / counts).reshape(n_rows, q)
+
+
+def shift_rows(arr, k):
+    """ Shifts a 2-D array down by `k` rows, filling the top with NaN. """
+    if k == 0:
+        return arr
+    out = np.full_like(arr, np.nan)
+    out[k:] = arr[:-k]
+    return out
+
+
+@ins.timed('pf_hold')
+def pf_hold(df_cha, df_sorted, cha_name, q, hold=1, rebalance='M'):
+    """
+    Calculates equal-weighted portfolios formed at a given rebalancing frequency
+    and held for `hold` months, with overlapping cohorts averaged.
+
+    Parameters
+    ----------
+    df_cha : df
+        The output of `cha_main`, used for the monthly returns of every stock,
+        including the months after formation.
+    df_sorted : df
+        The output of `stock_sorting`, giving the rank of each stock at each formation.
+    cha_name : str
+        The name of the characteristic.
+    q : int
+        The number of quantiles.
+    hold : int
+        Holding period K in months. Each cohort earns returns in its formation row
+        and the K-1 following year-months. K shorter than the rebalancing interval
+        (3 months for 'Q', 12 for 'A') is raised to it, so each cohort is held
+        until the next rebalancing date.
+    rebalance : str
+        Rebalancing frequency, 'M', 'Q' or 'A'. See `formation_mask`.
+
+    Returns
+    -------
+    df
+        A DataFrame with the same columns as `pf_cal` ('ewp_rank_1', ..., 'ls'),
+        with Monthly frequency PeriodIndex named 'Year_Month'. Each value is the
+        average over the cohorts alive in that year-month. With hold=1 and
+        rebalance='M' the result equals `pf_cal`.
+    """
+    tickers = [i for i in df_cha.columns if i.find('_{}'.format(cha_name)) == -1]
+    index = df_cha.index
+    ret = df_cha[tickers].to_numpy(dtype=float)
+
+    ranks = rank_matrix(df_sorted, index, tickers)
+    ranks[~formation_mask(index, rebalance)] = np.nan
+    # Carry each formation's ranks forward at least until the next rebalancing date
+    hold = max(hold, 12 // len(REBALANCE_MONTHS[rebalance]))
+
+    cohorts = np.stack([bucket_returns(ret, shift_rows(ranks, k), q) for k in range(hold)])
+    alive = (~np.isnan(cohorts)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pf_ret = np.nansum(cohorts, axis=0) / alive
+
+    df = pd.DataFrame(pf_ret, index=index, columns=['ewp_rank_{}'.format(i + 1) for i in range(q)])
+    df['ls'] = df['ewp_rank_{}'.format(q)] - df['ewp_rank_1']
+    df = df.dropna(how='all')
+
+    util.color_print('pf_hold function done')
+    return df
+
+
+def pf_hold_main(df_cha, cha_name, q, hold=1, rebalance='M'):
+    """
+    Same as `pf_main` in zid_project2_portfolio.py, but with a holding period of
+    `hold` months and rebalancing frequency `rebalance`. See `pf_hold`.
+    """
+    pf.pf_input_sanity_check(df_cha, cha_name)
+    df_reshaped = pf.df_reshape(df_cha, cha_name)
+    df_sorted = pf.stock_sorting(df_reshaped, cha_name, q)
+    return pf_hold(df_cha, df_sorted, cha_name, q, hold, rebalance)
+
+
+def _test_pf_hold(df_cha, cha_name, q):
+    """ Test function for `pf_hold`. The monthly, one-month-hold output should
+    equal `pf_cal`; the 3-month overlapping output is printed next to it.
+
+    >> made_up_df_cha = pf._test_df_cha_gen()
+    >> _test_pf_hold(made_up_df_cha, 'cha_name', 2)
+    """
+    df_sorted = pf.stock_sorting(pf.df_reshape(df_cha, cha_name), cha_name, q)
+    to_print = [
+        f"pf_cal:\n{pf.pf_cal(df_sorted, cha_name, q)}",
+        f"pf_hold(hold=1, rebalance='M'):\n{pf_hold(df_cha, df_sorted, cha_name, q)}",
+        f"pf_hold(hold=3, rebalance='M'):\n{pf_hold(df_cha, df_sorted, cha_name, q, hold=3)}",
+    ]
+    util.test_print('\n'.join(to_print))
+
+
+if __name__ == "__main__":
+    pass
+    # made_up_df_cha = pf._test_df_cha_gen()
+    # _test_pf_hold(made_up_df_cha, 'cha_name', 2)
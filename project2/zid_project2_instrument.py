@@ -0,0 +1,176 @@
+""" zid_project2_instrument.py
+
+Stage-level timing and memory instrumentation for the project 2 pipeline.
+
+Each instrumented stage records its wall time, CPU time, the peak resident
+set size (RSS) of the process after the stage, and the shape of its output.
+Instrumentation is off by default; while it is off, `timed` wrappers call
+straight through to the wrapped function and `stage` returns a shared no-op
+context manager, so nothing is measured or stored.
+
+Example:
+
+    >> ins.enable()
+    >> dict_ret, df_cha, df_portfolios = portfolio_main(...)
+    >> print(ins.to_json())
+    >> ins.enable(False)
+"""
+
+import functools
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_ENABLED = False
+
+# One dictionary per finished stage, in completion order
+RECORDS = []
+
+
+def enable(flag=True):
+    """ Turns instrumentation on (or off, if `flag` is False). """
+    global _ENABLED
+    _ENABLED = bool(flag)
+
+
+def is_enabled():
+    """ Returns True if instrumentation is on. """
+    return _ENABLED
+
+
+def reset():
+    """ Removes all stored stage records. """
+    RECORDS.clear()
+
+
+def _peak_rss_mb():
+    """ Returns the peak RSS of this process in MB, or None if unavailable. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _shape(obj):
+    """ Returns [rows, columns] of a DataFrame/Series output, a dictionary of
+    shapes for a dictionary output (e.g. the `ret` dictionary), or None.
+    """
+    if isinstance(obj, dict):
+        return {key: _shape(val) for key, val in obj.items()}
+    shape = getattr(obj, 'shape', None)
+    if shape is None:
+        return None
+    return [shape[0], shape[1] if len(shape) > 1 else 1]
+
+
+class Stage:
+    """ Context manager that records one stage. Assign the stage output to
+    the `output` attribute to have its shape recorded.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.output = None
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        RECORDS.append({
+            'stage': self.name,
+            'wall_s': time.perf_counter() - self._wall,
+            'cpu_s': time.process_time() - self._cpu,
+            'peak_rss_mb': _peak_rss_mb(),
+            'shape': _shape(self.output),
+            'failed': exc_type is not None,
+        })
+        self.output = None
+        return False
+
+
+class _NullStage:
+    """ No-op stand-in for `Stage` used while instrumentation is off.
+    Assignments to `output` are dropped so no reference is kept alive.
+    """
+    output = None
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """ Returns a context manager that records the enclosed block as stage `name`.
+
+    >> with ins.stage('aj_ret_dict') as st:
+    >>     st.output = etl.aj_ret_dict(tickers, start, end)
+    """
+    if not _ENABLED:
+        return _NULL_STAGE
+    return Stage(name)
+
+
+def timed(name=None):
+    """ Decorator that records each call of the decorated function as a stage.
+    The stage name defaults to the function name.
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with Stage(stage_name) as st:
+                out = func(*args, **kwargs)
+                st.output = out
+            return out
+        return wrapper
+    return decorator
+
+
+def to_json(pth=None):
+    """ Returns the stage records as a JSON string and, if `pth` is given,
+    also saves them to that file.
+    """
+    out = json.dumps(RECORDS, indent=2)
+    if pth is not None:
+        with open(pth, 'w') as file:
+            file.write(out)
+    return out
+
+
+def _test_timed():
+    """ Test function for `timed` and `to_json` """
+    @timed('sleep')
+    def _sleep():
+        time.sleep(0.05)
+
+    _sleep()
+    print(f"Disabled, records: {RECORDS}")
+    enable()
+    _sleep()
+    enable(False)
+    print(to_json())
+    reset()
+
+
+if __name__ == "__main__":
+    pass
+    # _test_timed()
@@ -0,0 +1,65 @@
+""" zid_project2_log.py
+
+Leveled logging for project 2 diagnostics.
+
+All project 2 modules log under the 'project2' logger. Diagnostic output such
+as the head of intermediate tables is logged at DEBUG level with lazy
+%-style arguments, so the text of a DataFrame is only built when a DEBUG
+message is actually emitted.
+
+    >> import zid_project2_log as log
+    >> log.enable_debug()        # show the diagnostic tables again
+    >> log.set_perf_mode()       # nothing below WARNING, whatever the config
+"""
+
+import logging
+
+LOGGER_NAME = 'project2'
+
+_perf_mode = False
+_saved_levels = {}
+
+
+def get_logger(name=None):
+    """ Returns the project 2 logger, or its child 'project2.<name>'. """
+    if name is None:
+        return logging.getLogger(LOGGER_NAME)
+    return logging.getLogger('{}.{}'.format(LOGGER_NAME, name))
+
+
+def enable_debug():
+    """ Prints all project 2 diagnostics, including DEBUG messages, to stderr. """
+    logger = get_logger()
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(name)s %(levelname)s: %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+
+
+def set_perf_mode(flag=True):
+    """ Turns performance mode on (or off, if `flag` is False).
+
+    In performance mode the project 2 logger drops everything below WARNING,
+    so no diagnostic message (and no DataFrame repr) is ever formatted.
+    Child loggers are reset to inherit that level, even if they were set to
+    DEBUG. Turning it off restores the levels the loggers had before.
+    """
+    global _perf_mode, _saved_levels
+    if flag and not _perf_mode:
+        prefix = LOGGER_NAME + '.'
+        names = [LOGGER_NAME] + [name for name in logging.root.manager.loggerDict if name.startswith(prefix)]
+        _saved_levels = {name: logging.getLogger(name).level for name in names}
+        for name in names:
+            logging.getLogger(name).setLevel(logging.NOTSET)
+        get_logger().setLevel(logging.WARNING)
+    elif not flag and _perf_mode:
+        for name, level in _saved_levels.items():
+            logging.getLogger(name).setLevel(level)
+        _saved_levels = {}
+    _perf_mode = bool(flag)
+
+
+def is_perf_mode():
+    """ Returns True if performance mode is on. """
+    return _perf_mode
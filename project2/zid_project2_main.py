@@ -27,16 +27,28 @@
 # We've imported other needed scripts and defined aliases. Please keep using the same aliases for them in this project.
 import zid_project2_etl as etl
 import zid_project2_characteristics as cha
+import zid_project2_calendar as cd
 import zid_project2_portfolio as pf
+import zid_project2_sorts as so
+import zid_project2_tickers as tk
+import zid_project2_cache as sc
+import zid_project2_instrument as ins
+import zid_project2_log as log
+import zid_project2_precision as pr
+import zid_project2_stats as st
 import util as util
 import pandas as pd
+import numpy as np
+# Optional stages (analytics, xsection, ...) are imported by the functions that use them
 
 
 # -----------------------------------------------------------------------------------------------
 # Part 3: Follow the workflow in portfolio_main function
 #         to understand how this project construct total volatility long-short portfolio
 # -----------------------------------------------------------------------------------------------
-def portfolio_main(tickers, start, end, cha_name, ret_freq_use, q):
+def portfolio_main(tickers, start, end, cha_name, ret_freq_use, q, profile_pth=None, perf_mode=False,
+                   precision='float64', cal=None, cache=None, datdir=None, preprocess=None, eligible=None,
+                   tic_exchange_dic=None):
     """
     Constructs equal-weighted portfolios based on the specified characteristic and quantile threshold.
     We focus on total volatility investment strategy in this project 2.
@@ -75,10 +87,60 @@ def portfolio_main(tickers, start, end, cha_name, ret_freq_use, q):
         It identifies that which frequency returns you will use to construct the `cha_name`
         in zid_project2_characteristics.py.
         Set it as ['Daily',] when calculating stock total volatility here.
+        Set it as ['OHLC',] for the range-based volatilities (e.g. 'rsuvol'); the daily
+        prices of the ".dat" files in `datdir` are then added to `dict_ret` under 'OHLC'.
 
     q : int
         The number of quantiles to divide the stocks into based on their characteristic values.
 
+    profile_pth : str, optional
+        If given, the wall time, CPU time, peak RSS and output shape of each stage
+        (`aj_ret_dict`, `vol_cal`, `merge_tables`, `df_reshape`, `stock_sorting`, `pf_cal`)
+        are recorded with zid_project2_instrument.py and saved as JSON to this path.
+        If None (the default), no instrumentation is done.
+
+    perf_mode : bool
+        If True, the run is made in performance mode (see zid_project2_log.py):
+        diagnostic messages below WARNING are dropped without being formatted,
+        so no DataFrame repr is built. The previous logging level is restored afterwards.
+
+    precision : str
+        'float64' (the default) or 'float32'. With 'float32' the return dictionary and
+        all later tables are stored as float32 (see zid_project2_precision.py).
+        Use `precision_check` in zid_project2_precision.py to compare the results with
+        the float64 path.
+
+    cal : TradingCalendar, optional
+        The trading calendar shared by the stages (see zid_project2_calendar.py).
+        If None (the default), it is built once from the dates of the daily return table
+        and, with 'OHLC' in `ret_freq_use`, of the daily prices.
+
+    cache : StageCache, optional
+        If given, the output of each stage is stored on disk and loaded instead of
+        recomputed when the stage inputs and code are unchanged, e.g. changing only
+        `q` reruns `pf_main` alone. See zid_project2_cache.py.
+
+    datdir : str, optional
+        The folder of the price files. With `cache`, the names, sizes and modification
+        times of its files are part of the key of the `aj_ret_dict` stage, so refreshed
+        prices are reloaded. If None (the default), `default_datdir()` in
+        zid_project2_cache.py.
+
+    preprocess : list, optional
+        Cross-sectional steps applied to the characteristic before sorting, e.g.
+        ['winsorize', 'zscore']. Passed to `pf_main`, see zid_project2_xsection.py.
+        If None (the default), the raw values are sorted.
+
+    eligible : df, optional
+        A boolean (year-month x ticker) eligibility matrix from `eligibility` in
+        zid_project2_universe.py, passed to `pf_main`. If None (the default), all
+        stocks are sorted.
+
+    tic_exchange_dic : dict, optional
+        The output of `get_tics` in zid_project1.py. The shared ticker dictionary of the
+        long tables is built from it once for this run (see zid_project2_tickers.py). If
+        None (the default), the dictionary set with `build_tic_dtype` is used, or else
+        one built from `tickers`. The previous dictionary is restored afterwards.
 
     Returns
     -------
@@ -102,22 +164,91 @@ def portfolio_main(tickers, start, end, cha_name, ret_freq_use, q):
 
     """
 
+    if perf_mode and not log.is_perf_mode():
+        log.set_perf_mode()
+        try:
+            return portfolio_main(tickers, start, end, cha_name, ret_freq_use, q, profile_pth,
+                                  precision=precision, cal=cal, cache=cache, datdir=datdir,
+                                  preprocess=preprocess, eligible=eligible, tic_exchange_dic=tic_exchange_dic)
+        finally:
+            log.set_perf_mode(False)
+
+    if profile_pth is not None:
+        ins.reset()
+        ins.enable()
+        try:
+            return portfolio_main(tickers, start, end, cha_name, ret_freq_use, q, precision=precision, cal=cal,
+                                  cache=cache, datdir=datdir, preprocess=preprocess, eligible=eligible,
+                                  tic_exchange_dic=tic_exchange_dic)
+        finally:
+            ins.enable(False)
+            ins.to_json(profile_pth)
+
+    # One ticker dictionary for every long table of this run, so they share category codes
+    if tic_exchange_dic is not None or tk.get_tic_dtype() is None:
+        prev = tk.get_tic_dtype()
+        tk.build_tic_dtype(tickers if tic_exchange_dic is None else tic_exchange_dic)
+        try:
+            return portfolio_main(tickers, start, end, cha_name, ret_freq_use, q, precision=precision, cal=cal,
+                                  cache=cache, datdir=datdir, preprocess=preprocess, eligible=eligible)
+        finally:
+            tk.set_tic_dtype(prev)
+
     # --------------------------------------------------------------------------------------------------------
     # Part 4: Complete etl scaffold to generate returns dictionary and to make ad_ret_dic function works
     # --------------------------------------------------------------------------------------------------------
-    dict_ret = etl.aj_ret_dict(tickers, start, end)
+    datdir = sc.default_datdir() if datdir is None else datdir
+    # Range-based volatilities also need the daily prices, see zid_project2_ohlc.py
+    use_ohlc = 'OHLC' in ret_freq_use
+    ret_modules = [etl, pr]
+    cha_modules = [cha, cd, pr]
+    if use_ohlc:
+        import zid_project2_ohlc as oh
+        ret_modules.append(oh)
+        cha_modules.append(oh)
+
+    def load_ret():
+        res = etl.aj_ret_dict(tickers, start, end)
+        if use_ohlc:
+            res['OHLC'] = oh.ohlc_panel(tickers, datdir, start, end)
+        return pr.cast_ret_dict(res, precision)
+
+    with ins.stage('aj_ret_dict') as stg:
+        data = None if cache is None else sc.dir_fingerprint(datdir)
+        dict_ret, ret_key = sc.run_stage(
+            cache, 'aj_ret_dict',
+            {'tickers': list(tickers), 'start': start, 'end': end, 'precision': precision, 'data': data,
+             'ohlc': use_ohlc},
+            load_ret, ret_modules)
+        stg.output = dict_ret
+    if cal is None:
+        cal = cd.TradingCalendar.from_frames(dict_ret['Daily'], *dict_ret.get('OHLC', {}).values())
 
     # ---------------------------------------------------------------------------------------------------------
     # Part 5: Complete cha scaffold to generate dataframe containing monthly total volatility for each stock
     #         and to make char_main function work
     # ---------------------------------------------------------------------------------------------------------
-    df_cha = cha.cha_main(dict_ret, cha_name,  ret_freq_use)
+    df_cha, cha_key = sc.run_stage(
+        cache, 'cha_main', {'ret': ret_key, 'cha_name': cha_name, 'ret_freq_use': list(ret_freq_use)},
+        lambda: cha.cha_main(dict_ret, cha_name,  ret_freq_use, precision, cal), cha_modules)
 
     # -----------------------------------------------------------------------------------------------------------
     # Part 6: Read and understand functions in pf scaffold. You will need to utilize functions there to
     #         complete some of the questions in Part 7
     # -----------------------------------------------------------------------------------------------------------
-    df_portfolios = pf.pf_main(df_cha, cha_name, q)
+    pf_modules = [pf, so, tk, pr]
+    if preprocess:
+        import zid_project2_xsection as xs
+        pf_modules.append(xs)
+    if eligible is not None:
+        import zid_project2_universe as un
+        pf_modules.append(un)
+    df_portfolios, _ = sc.run_stage(
+        cache, 'pf_main',
+        {'cha': cha_key, 'q': q, 'preprocess': list(preprocess) if preprocess else None,
+         'eligible': None if cache is None else sc.frame_fingerprint(eligible)},
+        lambda: pf.pf_main(df_cha, cha_name, q, precision=precision, preprocess=preprocess, eligible=eligible),
+        pf_modules)
 
     util.color_print('Portfolio Construction All Done!')
 
@@ -127,7 +258,7 @@ def portfolio_main(tickers, start, end, cha_name, ret_freq_use, q):
 # ----------------------------------------------------------------------------
 # Part 7: Complete the auxiliary functions
 # ----------------------------------------------------------------------------
-def get_avg(df: pd.DataFrame, year):
+def get_avg(df: pd.DataFrame, year, cal=None, cache=False):
     """ Returns the average value of all columns in the given df for a specified year.
 
     This function will calculate the column average for all columns
@@ -144,6 +275,18 @@ def get_avg(df: pd.DataFrame, year):
     year : int
         The year as a 4-digit integer.
 
+    cal : TradingCalendar, optional
+        If given, the rows of each year are found from the calendar's year
+        boundaries; `df` must then be sorted by its index.
+        See zid_project2_calendar.py.
+
+    cache : bool
+        If True, the averages of all years are computed in one pass by `year_stats`
+        in zid_project2_stats.py and cached for (`df`, `cal`), so later calls with
+        another year are lookups. `df` must then not be modified in place, or be
+        dropped with `clear_cache` in zid_project2_stats.py first. If False (the
+        default), only the rows of `year` are averaged and nothing is cached.
+
     Returns
     -------
     ser
@@ -168,7 +311,13 @@ def get_avg(df: pd.DataFrame, year):
 
     """
     # <COMPLETE THIS PART>
-    year_data = df[df.index.year == year]
+    if cache:
+        means = st.year_stats(df, cal, cache=True, stats=('mean',))['mean']
+        if year in means.index:
+            return means.loc[year].rename(None)
+        return pd.Series(np.nan, index=df.columns)
+    # One year only: slice its rows (or mask them without a calendar)
+    year_data = df.iloc[cal.year_rows(df.index, year)] if cal is not None else df[df.index.year == year]
     return year_data.mean(skipna=True)
 
 def get_cumulative_ret(df):
@@ -195,9 +344,14 @@ def get_cumulative_ret(df):
         (1 + r1) * (1 + r2) *....* (1 + rN) - 1
         where r1, ..., rN represents monthly returns
 
+    It is computed from cumulative sums of log(1 + r) by `LogReturns` in
+    zid_project2_analytics.py, which also gives rolling returns, drawdowns,
+    Sharpe and Sortino ratios.
+
     """
     # <COMPLETE THIS PART>
-    return (1 + df).cumprod() - 1
+    import zid_project2_analytics as an
+    return an.LogReturns(df).cumulative()
 
 # ----------------------------------------------------------------------------
 # Part 8: Answer questions
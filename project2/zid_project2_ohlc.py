@@ -0,0 +1,261 @@
+""" zid_project2_ohlc.py
+
+Range-based volatility from daily Open, High, (Low) and Close prices.
+
+`vol_cal` uses the standard deviation of close-to-close returns, which needs
+18 or more days a month. Range-based estimators use the path of the price
+within each day, so each day gives a variance estimate with a smaller error
+and a monthly estimate needs fewer days.
+
+With u = ln(High / Open), d = ln(Low / Open) and c = ln(Close / Open), the
+daily variance estimators are
+
+    'pk'  Parkinson:        (u - d)^2 / (4 ln 2)
+    'gk'  Garman-Klass:     0.5 (u - d)^2 - (2 ln 2 - 1) c^2
+    'rs'  Rogers-Satchell:  u (u - c) + d (d - c)
+
+The ".dat" files have no Low column, so for them only estimators from O, H
+and C can be used:
+
+    'rsu' upper half of Rogers-Satchell, doubled:  2 u (u - c)
+    'hi'  squared upper range:                      u^2
+    'oc'  squared open-to-close return:             c^2
+
+For a driftless random walk each one has expected value equal to the
+intraday variance (the maximum of a Brownian motion started at 0 has the
+distribution of |N(0, sigma^2)|, so E[u^2] = sigma^2). None of them include
+the overnight (close-to-open) move, so they are lower than `vol` on average.
+
+Prices enter only as ratios within a day, so unadjusted Open, High and Close
+can be used. The monthly volatility is the square root of the average daily
+variance estimate, set to NaN with fewer than `OHLC_MIN_DAYS` valid days.
+
+The prices are passed to `cha_main` under the 'OHLC' key of the return
+dictionary, see `ohlc_panel`:
+
+    >> ret = etl.aj_ret_dict(tickers, start, end)
+    >> ret['OHLC'] = ohlc_panel(tickers, DATDIR, start, end)
+    >> df_cha = cha.cha_main(ret, 'rsuvol', ['OHLC',])
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import zid_project2_calendar as cd
+import zid_project2_precision as pr
+
+# Column layout of the ".dat" files, see project1/README.txt
+DAT_COLUMNS = ['Volume', 'Date', 'Adj Close', 'Close', 'Open', 'High']
+DAT_COLWIDTHS = {'Volume': 14, 'Date': 11, 'Adj Close': 19, 'Close': 10, 'Open': 6, 'High': 20}
+
+# Estimators and the price columns they need
+ESTIMATORS = {
+    'pk': ('High', 'Low'),
+    'gk': ('Open', 'High', 'Low', 'Close'),
+    'rs': ('Open', 'High', 'Low', 'Close'),
+    'rsu': ('Open', 'High', 'Close'),
+    'hi': ('Open', 'High'),
+    'oc': ('Open', 'Close'),
+}
+
+# Fewest valid days for a monthly estimate
+OHLC_MIN_DAYS = 10
+
+
+def read_dat_prices(pth, columns=DAT_COLUMNS, colwidths=DAT_COLWIDTHS):
+    """ Returns the prices of one ".dat" file as a DataFrame indexed by 'Date'. """
+    dtypes = {col: 'float64' for col in columns}
+    dtypes['Date'] = str
+    df = pd.read_fwf(pth, widths=[colwidths[col] for col in columns], names=columns, header=None, dtype=dtypes)
+    df['Date'] = pd.to_datetime(df['Date'].str.strip(), format='%Y-%m-%d')
+    return df.set_index('Date')
+
+
+def ohlc_panel(tickers, datdir, start=None, end=None, fields=('Open', 'High', 'Low', 'Close')):
+    """ Reads the ".dat" file `<datdir>/<tic>_prc.dat` of each ticker and returns
+    the price fields as wide tables.
+
+    Parameters
+    ----------
+    tickers : list
+        Tickers (any case).
+    datdir : str
+        The folder with the ".dat" files.
+    start, end : str, optional
+        Inclusive date range.
+    fields : tuple
+        The price fields to return. Fields that are not in the files (e.g. 'Low')
+        are skipped.
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<field> : <df>}, where each DataFrame has a
+        DatetimeIndex named 'Date' and one lower-case ticker column per stock.
+    """
+    prices = {tic.lower(): read_dat_prices(os.path.join(datdir, '{}_prc.dat'.format(tic.lower())))
+              for tic in tickers}
+    panel = {}
+    for field in fields:
+        if all(field in df.columns for df in prices.values()):
+            df = pd.DataFrame({tic: p[field] for tic, p in prices.items()}).sort_index()
+            df.index.name = 'Date'
+            panel[field] = df.loc[start:end]
+    return panel
+
+
+def log_prices(ohlc, fields):
+    """ Returns {<field>: (T x N) array of log prices} for `fields`, aligned on the
+    dates and tickers of the first field, NaN where a price is missing or not positive.
+    """
+    ref = ohlc[fields[0]]
+    logs = {}
+    for f in fields:
+        v = ohlc[f].reindex(index=ref.index, columns=ref.columns).to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            logs[f] = np.log(np.where(v > 0, v, np.nan))
+    return logs
+
+
+def _check_fields(ohlc, estimator):
+    """ Raises a ValueError if `estimator` is unknown or its price fields are not in `ohlc`. """
+    if estimator not in ESTIMATORS:
+        raise ValueError("`estimator` must be one of {}".format(list(ESTIMATORS)))
+    missing = [f for f in ESTIMATORS[estimator] if f not in ohlc]
+    if missing:
+        raise ValueError("Estimator '{}' needs the price fields {}".format(estimator, missing))
+
+
+def variance_from_logs(logs, estimator):
+    """ Returns the (T x N) array of daily variance estimates from the output of `log_prices`. """
+    # Only the estimator's own fields, so the estimate does not depend on what else was loaded
+    logs = {f: logs[f] for f in ESTIMATORS[estimator]}
+    if estimator == 'pk':
+        return (logs['High'] - logs['Low']) ** 2 / (4 * np.log(2))
+
+    # Relative to the Open; the High is at least the Open and the Close,
+    # and the Low at most both
+    c = logs['Close'] - logs['Open'] if 'Close' in logs else np.zeros_like(logs['Open'])
+    u = np.maximum(logs['High'] - logs['Open'], np.maximum(c, 0.0)) if 'High' in logs else None
+    d = np.minimum(logs['Low'] - logs['Open'], np.minimum(c, 0.0)) if 'Low' in logs else None
+
+    if estimator == 'gk':
+        return 0.5 * (u - d) ** 2 - (2 * np.log(2) - 1) * c ** 2
+    if estimator == 'rs':
+        return u * (u - c) + d * (d - c)
+    if estimator == 'rsu':
+        return 2 * u * (u - c)
+    if estimator == 'hi':
+        return u ** 2
+    return c ** 2
+
+
+def daily_variance(ohlc, estimator):
+    """ Returns the (T x N) array of daily variance estimates, NaN where a price is
+    missing or not positive.
+
+    Parameters
+    ----------
+    ohlc : dict
+        The output of `ohlc_panel`.
+    estimator : str
+        A key of `ESTIMATORS`.
+    """
+    _check_fields(ohlc, estimator)
+    return variance_from_logs(log_prices(ohlc, ESTIMATORS[estimator]), estimator)
+
+
+def ohlc_vols(ohlc, estimators, cal=None, min_days=OHLC_MIN_DAYS):
+    """ Returns several monthly range-based volatilities computed together: the log
+    prices are taken once, and the monthly averages of all estimators come from
+    one grouped pass over the trading calendar.
+
+    Parameters
+    ----------
+    ohlc : dict
+        The output of `ohlc_panel`.
+    estimators : dict
+        {<cha_name>: <estimator>}, e.g. {'rsuvol': 'rsu', 'ocvol': 'oc'}.
+    cal : TradingCalendar, optional
+        The trading calendar (see zid_project2_calendar.py). Only the months of
+        the price dates must be in it. If None, it is built from the price dates.
+    min_days : int
+        Months with fewer valid daily estimates are NaN.
+
+    Returns
+    -------
+    dict
+        {<cha_name>: <df>}, each df laid out as the output of `ohlc_vol`.
+    """
+    for estimator in estimators.values():
+        _check_fields(ohlc, estimator)
+    fields = [f for f in ('Open', 'High', 'Low', 'Close')
+              if any(f in ESTIMATORS[e] for e in estimators.values())]
+    ref = ohlc[fields[0]]
+    logs = log_prices(ohlc, fields)
+    cal = cd.TradingCalendar(ref.index) if cal is None else cal
+
+    n_tic = len(ref.columns)
+    var = np.hstack([variance_from_logs(logs, e) for e in estimators.values()])
+    mean, count = pr.grouped_mean(var, cal.month_ids(ref.index), cal.n_months)
+    vol = np.sqrt(np.maximum(mean, 0.0))
+    vol[count < min_days] = np.nan
+
+    dtype = np.result_type(*ref.dtypes)
+    res = {}
+    for i, cha_name in enumerate(estimators):
+        cols = ['{}_{}'.format(tic, cha_name) for tic in ref.columns]
+        df = pd.DataFrame(vol[:, i * n_tic:(i + 1) * n_tic], index=cal.months, columns=cols)
+        res[cha_name] = df.dropna(how='all').astype(dtype)
+    return res
+
+
+def ohlc_vol(ohlc, estimator, cha_name, cal=None, min_days=OHLC_MIN_DAYS):
+    """ Returns the monthly range-based volatility of each stock.
+
+    Parameters
+    ----------
+    ohlc : dict
+        The output of `ohlc_panel`.
+    estimator : str
+        A key of `ESTIMATORS`.
+    cha_name : str
+        Appended to the ticker in the column names, as in `vol_cal`.
+    cal : TradingCalendar, optional
+        The trading calendar of the prices (see zid_project2_calendar.py).
+        If None, it is built from the price dates.
+    min_days : int
+        Months with fewer valid daily estimates are NaN.
+
+    Returns
+    -------
+    df
+        A DataFrame with the same layout as the output of `vol_cal`: a Monthly
+        frequency PeriodIndex named 'Year_Month', one column `<tic>_<cha_name>`
+        per stock, rows with all NaN removed. The values have the dtype of the prices.
+    """
+    return ohlc_vols(ohlc, {cha_name: estimator}, cal, min_days)[cha_name]
+
+
+def _test_ohlc_vol(tickers, datdir, start, end):
+    """ Test function for `ohlc_vol`. Prints each estimator available from the
+    ".dat" files next to the close-to-close `vol` of the first ticker.
+
+    >> _test_ohlc_vol(['AAPL', 'DIS'], '../project1/project1/data', '2010-01-01', '2012-12-31')
+    """
+    import zid_project2_etl as etl
+    import zid_project2_characteristics as cha
+
+    ohlc = ohlc_panel(tickers, datdir, start, end)
+    df = cha.vol_cal(etl.aj_ret_dict(tickers, start, end), 'vol', ['Daily', ])
+    for estimator in ESTIMATORS:
+        if all(f in ohlc for f in ESTIMATORS[estimator]):
+            df = df.join(ohlc_vol(ohlc, estimator, estimator + 'vol'))
+    tic = tickers[0].lower()
+    print(df[[col for col in df.columns if col.startswith(tic + '_')]].head())
+
+
+if __name__ == "__main__":
+    pass
+    # _test_ohlc_vol(['AAPL', 'DIS'], '../project1/project1/data', '2010-01-01', '2012-12-31')
@@ -7,12 +7,16 @@
 #         zid_project2_portfolio.py to answer the questions in Part 7
 # ------------------------------------------------------------------------------------------------------------------
 
-import zid_project2_etl as etl
-import zid_project2_characteristics as cha
 import pandas as pd
 import numpy as np
 import util
 import sys
+import zid_project2_instrument as ins
+import zid_project2_log as log
+import zid_project2_precision as pr
+import zid_project2_sorts as so
+
+logger = log.get_logger('pf')
 
 
 def pf_input_sanity_check(df_cha, cha_name):
@@ -70,19 +74,20 @@ def pf_input_sanity_check(df_cha, cha_name):
         return sys.exit("`cha_name` must be a string")
 
     if df_cha.index.dtype == 'period[M]':
-        print("df_cha table is in monthly frequency")
+        logger.info("df_cha table is in monthly frequency")
     else:
         sys.exit("Please make sure df_cha table is in monthly frequency")
 
     if tics_cha == tics:
-        print("df_cha includes stocks' monthly returns and respective characteristics")
+        logger.info("df_cha includes stocks' monthly returns and respective characteristics")
     else:
         sys.exit("Please make sure df_cha includes stocks' monthly returns and respective characteristics")
 
     return util.color_print('Sanity checks for inputs of long short portfolio construction passed')
 
 
-def df_reshape(df_cha, cha_name):
+@ins.timed('df_reshape')
+def df_reshape(df_cha, cha_name, eligible=None):
     """
     Reshapes a DataFrame to consolidate return and characteristic columns for each ticker.
 
@@ -102,6 +107,10 @@ def df_reshape(df_cha, cha_name):
     cha_name : str
         The name of the characteristic.
 
+    eligible : df, optional
+        A boolean (year-month x ticker) eligibility matrix, see zid_project2_universe.py.
+        If given, only stocks eligible in the previous year-month get a row.
+
     Returns
     -------
     df
@@ -111,6 +120,8 @@ def df_reshape(df_cha, cha_name):
         - df.columns: it has three columns: 'Ret', which contains monthly returns;
           `{cha_name}`, which holds the characteristics;
           and 'ticker', which identifies the stock ticker associated with the returns and characteristics.
+          The 'ticker' column is categorical, with the shared ticker dictionary of
+          zid_project2_tickers.py as categories if it has been built.
 
         - df.index: Monthly frequency PeriodIndex with name of 'Year_Month'.
 
@@ -153,27 +164,23 @@ def df_reshape(df_cha, cha_name):
        ---  ------  --------------  -----
         0   Ret     11 non-null     float64
         1   vol     7 non-null      float64
-        2   ticker  15 non-null     object
-       dtypes: float64(2), object(1)
+        2   ticker  15 non-null     category
+       dtypes: category(1), float64(2)
         """
-    # collect tics
-    tickers = [i for i in df_cha.columns if i.find('_{}'.format(cha_name)) == -1]
-    df_collect = pd.DataFrame()
-    # iterate tics and reshape table
-    for ticker in tickers:
-        temp = df_cha[[ticker, ticker + '_{}'.format(cha_name)]]
-        temp = temp.rename({'{}'.format(ticker): 'Ret',
-                            '{}_{}'.format(ticker, cha_name): '{}'.format(cha_name)}, axis=1)
-        temp['ticker'] = '{}'.format(ticker)
-        df_collect = pd.concat([df_collect, temp], axis=0)
-
-    df_reshaped = df_collect.copy()
+    # stack all tics at once; the ticker column is categorical (see zid_project2_tickers.py)
+    mask = None
+    if eligible is not None:
+        import zid_project2_universe as un
+        tickers = [col for col in df_cha.columns if not col.endswith('_{}'.format(cha_name))]
+        mask = un.holding_mask(eligible, df_cha.index, tickers)
+    df_reshaped = so.df_reshape_multi(df_cha, [cha_name], mask)
 
     util.color_print('df_reshape function done')
     return df_reshaped
 
 
-def stock_sorting(df_reshaped, cha_name, q):
+@ins.timed('stock_sorting')
+def stock_sorting(df_reshaped, cha_name, q, bp_tickers=None):
     """
     Sorts stocks into quantiles within each year-month based on a specified characteristic.
 
@@ -195,6 +202,11 @@ def stock_sorting(df_reshaped, cha_name, q):
     - q : int
         The number of quantiles to divide the stocks into based on their characteristic values.
 
+    - bp_tickers : list, optional
+        If given, the quantile breakpoints of each year-month are computed on these
+        tickers only (e.g. NYSE stocks, see `bp_universe` in zid_project2_sorts.py)
+        and then applied to all stocks. If None (the default), all stocks are used.
+
     Returns
     -------
     df
@@ -234,15 +246,21 @@ def stock_sorting(df_reshaped, cha_name, q):
        ---  ------  --------------  -----
        0   Ret     7 non-null      float64
        1   vol     7 non-null      float64
-       2   ticker  7 non-null      object
+       2   ticker  7 non-null      category
        3   rank    7 non-null      int64
-       dtypes: float64(2), int64(1), object(1)
+       dtypes: category(1), float64(2), int64(1)
 
     """
 
     df_reshaped.dropna(inplace=True)
-    rank_ser = df_reshaped.groupby(level=0)['{}'.format(cha_name)]\
-        .transform(lambda x: pd.qcut(x, q, labels=False, duplicates='drop')).rename('rank')
+    if bp_tickers is None:
+        rank_ser = df_reshaped.groupby(level=0)['{}'.format(cha_name)]\
+            .transform(lambda x: pd.qcut(x, q, labels=False, duplicates='drop')).rename('rank')
+    else:
+        month_codes, months = pd.factorize(df_reshaped.index)
+        bp_mask = df_reshaped['ticker'].isin(bp_tickers).to_numpy()
+        rank = so.sort_values(df_reshaped[cha_name].to_numpy(dtype=float), month_codes, len(months), q, bp_mask)
+        rank_ser = pd.Series(rank, index=df_reshaped.index, name='rank')
     df_sorted = pd.concat([df_reshaped, rank_ser], axis=1)
     df_sorted.dropna(inplace=True)
 
@@ -250,6 +268,7 @@ def stock_sorting(df_reshaped, cha_name, q):
     return df_sorted
 
 
+@ins.timed('pf_cal')
 def pf_cal(df_sorted, cha_name, q):
     """
     Calculates the equal-weighted portfolios for each quantile in the input table, `df_sorted`,
@@ -334,7 +353,8 @@ def pf_cal(df_sorted, cha_name, q):
     return df
 
 
-def pf_main(df_cha, cha_name, q):
+def pf_main(df_cha, cha_name, q, schemes=None, df_mcap=None, bp_tickers=None, precision='float64',
+            preprocess=None, winsor_pct=None, eligible=None, iv_col=None):
     """
     Constructs portfolios based on the specified characteristic and quantile threshold.
 
@@ -343,9 +363,12 @@ def pf_main(df_cha, cha_name, q):
        they meet required formats and constraints.
     2. Call `df_reshape` function to reshapes the input DataFrame `df_cha`
        to align with the processing needs for the third step, stock sorting.
+       If `preprocess` is given, call `cs_transform` in zid_project2_xsection.py on the
+       characteristic of the reshaped table.
     3. Call `stock_sorting` function to sort stocks and give them a ranking.
     4. Cal `pf_cal` function to constructs equal weighted long-short portfolios
-       using sorted stock table from step 3
+       using sorted stock table from step 3, or `pf_cal_weighted` in zid_project2_weights.py
+       if other weighting schemes are requested
 
     Parameters
     ----------
@@ -357,11 +380,45 @@ def pf_main(df_cha, cha_name, q):
         The name of the characteristic. Here, it should be 'vol'
     q : int
         The number of quantiles to divide the stocks into based on their characteristic values.
+    schemes : list, optional
+        Weighting schemes to build, a subset of ('ew', 'vw', 'iv', 'rw').
+        See zid_project2_weights.py. If None (the default), only equal-weighted portfolios are built.
+    df_mcap : df, optional
+        Lagged market capitalisation, required for 'vw'. See `lagged_mcap` in zid_project2_weights.py.
+    bp_tickers : list, optional
+        Tickers used to compute the quantile breakpoints, e.g. NYSE stocks only.
+        See `stock_sorting`. If None (the default), all stocks are used.
+    precision : str
+        'float64' (the default) or 'float32'. `df_cha` is cast to this dtype before
+        reshaping, so the long table and the portfolio returns are stored in it.
+        See zid_project2_precision.py.
+    preprocess : list, optional
+        Cross-sectional steps applied to the characteristic within each year-month
+        before sorting, in order, e.g. ['winsorize', 'zscore']. See zid_project2_xsection.py.
+        If None (the default), the raw values are sorted. The 'iv' weights always use
+        the untransformed volatility.
+    winsor_pct : tuple, optional
+        The (lower, upper) percentiles of the 'winsorize' step. If None (the default),
+        `WINSOR_PCT` of zid_project2_xsection.py, (0.01, 0.99).
+    eligible : df, optional
+        A boolean (year-month x ticker) eligibility matrix from `eligibility` in
+        zid_project2_universe.py. Stocks not eligible in a year-month are left out of
+        the next year-month's sort. If None (the default), all stocks are sorted.
+    iv_col : str, optional
+        The column of the reshaped table holding lagged volatility, used by 'iv'.
+        If None (the default), `cha_name`, so 'iv' needs a volatility characteristic
+        such as 'vol' or one of the OHLC estimators in zid_project2_ohlc.py.
 
     Returns
     -------
     df
-        A DataFrame containing the constructed equal-weighted quantile and long-short portfolios.
+        A DataFrame containing the constructed equal-weighted quantile and long-short portfolios,
+        plus the portfolios of any other weighting scheme in `schemes`.
+
+    Raises
+    ------
+    ValueError
+        If 'iv' is in `schemes` and `iv_col` is not a column of the reshaped table.
 
     Note:
     The function internally calls `pf_input_sanity_check`, `df_reshape`, `stock_sorting`, and `pf_cal` functions.
@@ -370,15 +427,33 @@ def pf_main(df_cha, cha_name, q):
 
     # sanity check for inputs
     pf_input_sanity_check(df_cha, cha_name)
+    df_cha = pr.cast_frame(df_cha, precision)
 
     # reshape the characteristic df
-    df_reshaped = df_reshape(df_cha, cha_name)
+    df_reshaped = df_reshape(df_cha, cha_name, eligible)
+    iv_col = cha_name if iv_col is None else iv_col
+    use_iv = schemes is not None and 'iv' in schemes
+    if use_iv and iv_col not in df_reshaped.columns:
+        raise ValueError("'iv' weights need a volatility column, but '{}' is not in the table of '{}'"
+                         .format(iv_col, cha_name))
+    if preprocess:
+        import zid_project2_xsection as xs
+        winsor_pct = xs.WINSOR_PCT if winsor_pct is None else winsor_pct
+        if use_iv:
+            # Inverse-volatility weights use the volatility itself, not its transform
+            df_reshaped['{}_raw'.format(iv_col)] = df_reshaped[iv_col]
+            iv_col = '{}_raw'.format(iv_col)
+        df_reshaped = xs.cs_transform(df_reshaped, [cha_name], preprocess, winsor_pct)
 
     # stock sorting
-    df_sorted = stock_sorting(df_reshaped, cha_name, q)
+    df_sorted = stock_sorting(df_reshaped, cha_name, q, bp_tickers)
 
     # portfolio construction
-    df_f = pf_cal(df_sorted, cha_name, q)
+    if schemes is None:
+        df_f = pf_cal(df_sorted, cha_name, q)
+    else:
+        import zid_project2_weights as wt
+        df_f = wt.pf_cal_weighted(df_sorted, cha_name, q, schemes, df_mcap, iv_col)
 
     util.color_print('portfolio script done')
     return df_f
@@ -450,8 +525,8 @@ def _test_df_reshape(df_cha,cha_name):
        ---  ------    --------------  -----
         0   Ret       15 non-null     float64
         1   cha_name  12 non-null     float64
-        2   ticker    20 non-null     object
-       dtypes: float64(2), object(1)
+        2   ticker    20 non-null     category
+       dtypes: category(1), float64(2)
        memory usage: 640.0+ bytes
        ----------------------------------------
     """
@@ -489,9 +564,9 @@ def _test_stock_sorting(df_cha, cha_name, q):
        ---  ------    --------------  -----
         0   Ret       7 non-null      float64
         1   cha_name  7 non-null      float64
-        2   ticker    7 non-null      object
+        2   ticker    7 non-null      category
         3   rank      7 non-null      float64
-       dtypes: float64(3), object(1)
+       dtypes: category(1), float64(3)
        memory usage: 280.0+ bytes
        ----------------------------------------
 
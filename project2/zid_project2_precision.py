@@ -0,0 +1,171 @@
+""" zid_project2_precision.py
+
+Storage precision of the return and characteristic panels.
+
+By default every panel is float64. With precision='float32' the return
+dictionary from `aj_ret_dict` and the `cha_main` output are stored as float32,
+which halves their memory and the bandwidth of the kernels that scan them.
+Sums whose rounding error matters (the variance sums of `vol_cal`) still
+accumulate in float64 and only the result is stored as float32.
+
+float32 keeps about 7 significant digits, so characteristics and portfolio
+returns differ from the float64 path by a relative error of about 1e-7.
+A stock whose characteristic is within that distance of a quantile
+breakpoint can land in the neighbouring quantile. Use `precision_check` to
+measure both effects on a given sample.
+"""
+
+import numpy as np
+import pandas as pd
+import util
+
+PRECISIONS = {
+    'float64': np.float64,
+    'float32': np.float32,
+}
+
+
+def get_dtype(precision):
+    """ Returns the numpy dtype of `precision` ('float64' or 'float32'). """
+    if precision not in PRECISIONS:
+        raise ValueError("`precision` must be one of {}".format(list(PRECISIONS)))
+    return PRECISIONS[precision]
+
+
+def cast_frame(df, precision):
+    """ Returns `df` with its float columns cast to `precision`.
+    No copy is made if they already have that dtype.
+    """
+    dtype = get_dtype(precision)
+    float_cols = df.select_dtypes(include='floating').columns
+    if (df[float_cols].dtypes == dtype).all():
+        return df
+    return df.astype({col: dtype for col in float_cols})
+
+
+def cast_ret_dict(ret, precision):
+    """ Returns a new return dictionary (see `aj_ret_dict` in zid_project2_etl.py)
+    with each DataFrame, including those of a nested dictionary such as the
+    'OHLC' prices, cast to `precision`. The input dictionary is not modified.
+    """
+    return {freq: cast_ret_dict(df, precision) if isinstance(df, dict) else cast_frame(df, precision)
+            for freq, df in ret.items()}
+
+
+def grouped_mean(values, codes, n_groups):
+    """ Returns the mean and the number of non-NaN values of each column of
+    `values` within each group, with the sums accumulated in float64.
+    See `grouped_std` for the parameters.
+    """
+    n_cols = values.shape[1]
+    valid = ~np.isnan(values)
+    cells = (codes[:, None] * n_cols + np.arange(n_cols))[valid]
+    size = n_groups * n_cols
+
+    count = np.bincount(cells, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(cells, weights=values[valid].astype(np.float64), minlength=size) / count
+
+    shape = (n_groups, n_cols)
+    return mean.reshape(shape).astype(values.dtype), count.reshape(shape)
+
+
+def grouped_std(values, codes, n_groups, ddof=1):
+    """ Returns the standard deviation and the number of non-NaN values of each
+    column of `values` within each group.
+
+    Sums are accumulated in float64 whatever the dtype of `values` (`np.bincount`
+    always adds its weights in float64), using two passes: the group means first,
+    then the sum of squared deviations from them.
+
+    Parameters
+    ----------
+    values : ndarray
+        (T x N) array of observations, NaN where missing.
+    codes : ndarray
+        Group (e.g. year-month) code of each of the T rows, in range(n_groups).
+    n_groups : int
+        Number of groups.
+    ddof : int
+        Delta degrees of freedom, as in `pd.DataFrame.std`.
+
+    Returns
+    -------
+    tuple
+        (std, count), two (n_groups x N) arrays. `std` has the dtype of `values`
+        and is NaN where count <= ddof.
+    """
+    n_cols = values.shape[1]
+    valid = ~np.isnan(values)
+    cells = (codes[:, None] * n_cols + np.arange(n_cols))[valid]
+    x = values[valid].astype(np.float64)
+    size = n_groups * n_cols
+
+    count = np.bincount(cells, minlength=size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(cells, weights=x, minlength=size) / count
+        ss = np.bincount(cells, weights=(x - mean[cells]) ** 2, minlength=size)
+        std = np.sqrt(ss / (count - ddof))
+    std[count <= ddof] = np.nan
+
+    shape = (n_groups, n_cols)
+    return std.reshape(shape).astype(values.dtype), count.reshape(shape)
+
+
+def precision_check(dict_ret, cha_name, ret_freq_use, q):
+    """ Compares the float32 path of `cha_main` and `pf_main` with the float64 path.
+
+    Parameters
+    ----------
+    dict_ret : dict
+        The output of `aj_ret_dict` (float64), e.g. the first output of `portfolio_main`.
+    cha_name, ret_freq_use, q :
+        As in `portfolio_main` in zid_project2_main.py.
+
+    Returns
+    -------
+    ser
+        A Series with
+        - 'cha_max_rel_err': largest relative error of the characteristic values;
+        - 'ret_max_abs_err': largest absolute error of the monthly stock returns;
+        - 'pf_max_abs_err': largest absolute error of the portfolio returns;
+        - 'n_rank_changes': number of (year-month, ticker) rows whose quantile differs;
+        - 'n_ranked': number of ranked rows in the float64 path.
+
+    Rank changes come from stocks whose characteristic lies within float32 rounding
+    of a quantile breakpoint; each one also moves the two affected portfolio returns.
+
+    Examples:
+    >> dict_ret, df_cha, df_pf = main.portfolio_main(['AAPL', 'TSLA', ...], '2000-01-01', '2020-12-31', 'vol', ['Daily',], 3)
+    >> precision_check(dict_ret, 'vol', ['Daily',], 3)
+    """
+    # Imported here: both modules import this one
+    import zid_project2_characteristics as cha
+    import zid_project2_portfolio as pf
+
+    df_cha = {}
+    df_sorted = {}
+    df_pf = {}
+    for precision in ('float64', 'float32'):
+        df_cha[precision] = cha.cha_main(dict_ret, cha_name, ret_freq_use, precision)
+        df_sorted[precision] = pf.stock_sorting(pf.df_reshape(df_cha[precision], cha_name), cha_name, q)
+        df_pf[precision] = pf.pf_main(df_cha[precision], cha_name, q, precision=precision)
+
+    cha_cols = [col for col in df_cha['float64'].columns if col.endswith('_{}'.format(cha_name))]
+    ret_cols = [col for col in df_cha['float64'].columns if col not in cha_cols]
+    cha64, cha32 = (df_cha[p][cha_cols].astype(float) for p in ('float64', 'float32'))
+    ret64, ret32 = (df_cha[p][ret_cols].astype(float) for p in ('float64', 'float32'))
+
+    keys = ['ticker']
+    rank64 = df_sorted['float64'].set_index(keys, append=True)['rank']
+    rank32 = df_sorted['float32'].set_index(keys, append=True)['rank'].reindex(rank64.index)
+
+    res = pd.Series({
+        'cha_max_rel_err': ((cha32 - cha64) / cha64).abs().max().max(),
+        'ret_max_abs_err': (ret32 - ret64).abs().max().max(),
+        'pf_max_abs_err': (df_pf['float32'].astype(float) - df_pf['float64']).abs().max().max(),
+        'n_rank_changes': int((rank32 != rank64).sum()),
+        'n_ranked': len(rank64),
+    })
+    util.test_print(res, "This means `precision_check(dict_ret, cha_name, ret_freq_use, q)`:")
+    return res
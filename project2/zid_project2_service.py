@@ -0,0 +1,253 @@
+""" zid_project2_service.py
+
+Long-running local service answering `portfolio_main`-style queries.
+
+Each call to `portfolio_main` imports pandas, rebuilds the return dictionary
+with `aj_ret_dict` and recomputes the characteristic before `pf_main` runs.
+The service does the first two once: `PanelStore` loads the return panels
+of a ticker universe and sample period at start-up, and keeps the outputs of
+`cha_main` and `pf_main` for the most recently used queries in an LRU cache.
+A repeated query is a cache lookup; a query with a new `q` reuses the cached
+characteristics and only runs `pf_main`.
+
+The service listens on localhost over HTTP, so it can be started, queried
+and stopped on one machine:
+
+    >> server, thread = start_service(PanelStore(tickers, '2000-12-29', '2021-08-31'))
+    >> df = query_service(server_url(server), ['AAPL', 'TSLA'], '2010-01-01', '2020-12-31', 'vol', 3)
+    >> server.shutdown()
+
+Endpoints:
+    GET /portfolio?tickers=aapl,tsla&start=2010-01-01&end=2020-12-31&cha_name=vol&q=3
+        The `pf_main` output as JSON ('index', 'columns', 'data'), plus
+        'cache' ('hit' or 'miss' for the portfolio table) and 'elapsed_ms'.
+    GET /stats
+        Cache size, hits and misses.
+
+Note: daily returns are sliced to [start, end] and monthly returns to the
+year-months of `start` to `end`, so the first and last month use the full
+month's return even when `start` or `end` falls inside the month.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+
+import pandas as pd
+import zid_project2_etl as etl
+import zid_project2_characteristics as cha
+import zid_project2_calendar as cd
+import zid_project2_portfolio as pf
+import zid_project2_log as log
+
+logger = log.get_logger('service')
+
+
+class PanelStore:
+    """ Return panels of a ticker universe loaded once, with an LRU cache of
+    characteristic and portfolio tables.
+
+    Parameters
+    ----------
+    tickers : list
+        The ticker universe. Queries may use any subset of it.
+    start, end : str
+        The sample period loaded at start-up. Queries may use any sub-period.
+    loader : callable, optional
+        A function with the signature of `aj_ret_dict`; defaults to `etl.aj_ret_dict`.
+    maxsize : int
+        The largest number of tables kept in the cache.
+    """
+
+    def __init__(self, tickers, start, end, loader=None, maxsize=32):
+        loader = etl.aj_ret_dict if loader is None else loader
+        self.ret = loader(tickers, start, end)
+        self.cal = cd.TradingCalendar.from_frames(self.ret['Daily'])
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ret_dict(self, tickers, start, end):
+        """ Returns the return dictionary of `tickers` over [start, end], sliced
+        from the loaded panels.
+
+        Raises
+        ------
+        ValueError
+            If a ticker is not in the loaded universe.
+        """
+        tickers = [tic.lower() for tic in tickers]
+        missing = sorted(set(tickers) - set(self.ret['Daily'].columns))
+        if missing:
+            raise ValueError("Tickers {} are not in the loaded universe".format(missing))
+        months = slice(pd.Period(start, 'M'), pd.Period(end, 'M'))
+        return {
+            'Daily': self.ret['Daily'].loc[start:end, tickers],
+            'Monthly': self.ret['Monthly'].loc[months, tickers],
+        }
+
+    def _cached(self, key, compute):
+        """ Returns (value, True) if `key` is in the cache, else (compute(), False)
+        after storing the value and evicting the least recently used entries.
+        """
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key], True
+            self.misses += 1
+
+        value = compute()
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return value, False
+
+    def characteristics(self, tickers, start, end, cha_name, ret_freq_use=('Daily',)):
+        """ Returns the `cha_main` output for the query and whether it came from the cache. """
+        tickers = tuple(sorted(tic.lower() for tic in tickers))
+        key = ('cha', tickers, start, end, cha_name, tuple(ret_freq_use))
+
+        def compute():
+            ret = self.ret_dict(tickers, start, end)
+            return cha.cha_main(ret, cha_name, list(ret_freq_use), cal=self.cal)
+        return self._cached(key, compute)
+
+    def portfolio(self, tickers, start, end, cha_name, q, ret_freq_use=('Daily',)):
+        """ Returns the `pf_main` output for the query and whether it came from the cache.
+        On a miss, the characteristics may still come from the cache.
+        """
+        tickers = tuple(sorted(tic.lower() for tic in tickers))
+        key = ('pf', tickers, start, end, cha_name, tuple(ret_freq_use), q)
+
+        def compute():
+            df_cha, _ = self.characteristics(tickers, start, end, cha_name, ret_freq_use)
+            return pf.pf_main(df_cha, cha_name, q)
+        return self._cached(key, compute)
+
+    def stats(self):
+        """ Returns a dictionary with the cache size, hits and misses. """
+        with self._lock:
+            return {'size': len(self._cache), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+
+def frame_to_json(df):
+    """ Returns a JSON-ready dictionary of `df`, with the index as strings. """
+    return {'index': [str(i) for i in df.index], 'columns': list(df.columns),
+            'data': df.astype(float).where(df.notna(), None).to_numpy().tolist()}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """ HTTP handler of the service. The `PanelStore` is `self.server.store`. """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if url.path == '/stats':
+            return self._send(200, self.server.store.stats())
+        if url.path != '/portfolio':
+            return self._send(404, {'error': 'Unknown path {}'.format(url.path)})
+
+        t0 = time.perf_counter()
+        try:
+            df, hit = self.server.store.portfolio(
+                params['tickers'].split(','), params['start'], params['end'],
+                params.get('cha_name', 'vol'), int(params.get('q', 3)),
+                params.get('ret_freq_use', 'Daily').split(','))
+        except KeyError as e:
+            return self._send(400, {'error': 'Missing parameter {}'.format(e)})
+        except (ValueError, SystemExit) as e:
+            # The sanity checks of cha_main and pf_main call sys.exit
+            return self._send(400, {'error': str(e)})
+
+        res = frame_to_json(df)
+        res['cache'] = 'hit' if hit else 'miss'
+        res['elapsed_ms'] = (time.perf_counter() - t0) * 1000
+        self._send(200, res)
+
+    def _send(self, status, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_service(store, host='127.0.0.1', port=0):
+    """ Starts serving `store` on a background thread.
+
+    Parameters
+    ----------
+    store : PanelStore
+        The loaded panels.
+    host : str
+        The address to listen on, localhost by default.
+    port : int
+        The port to listen on. 0 (the default) picks a free port, see `server_url`.
+
+    Returns
+    -------
+    tuple
+        (server, thread). Call `server.shutdown()` to stop the service.
+    """
+    server = ThreadingHTTPServer((host, port), ServiceHandler)
+    server.store = store
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info("Service listening on %s", server_url(server))
+    return server, thread
+
+
+def server_url(server):
+    """ Returns the base URL of a server started by `start_service`. """
+    host, port = server.server_address[:2]
+    return 'http://{}:{}'.format(host, port)
+
+
+def query_service(base_url, tickers, start, end, cha_name, q, ret_freq_use=('Daily',)):
+    """ Sends a portfolio query to the service at `base_url` and returns the
+    `pf_main` output as a DataFrame with a Monthly frequency PeriodIndex.
+    """
+    qry = urlencode({'tickers': ','.join(tickers), 'start': start, 'end': end,
+                     'cha_name': cha_name, 'q': q, 'ret_freq_use': ','.join(ret_freq_use)})
+    with urlopen('{}/portfolio?{}'.format(base_url.rstrip('/'), qry)) as resp:
+        res = json.load(resp)
+    index = pd.PeriodIndex(res['index'], freq='M', name='Year_Month')
+    return pd.DataFrame(res['data'], index=index, columns=res['columns'], dtype=float)
+
+
+def _test_service(tickers, start, end):
+    """ Test function for the service. Loads `tickers` over [start, end],
+    sends the same query twice (the second one hits the cache), and stops.
+
+    >> _test_service(['AAPL', 'TSLA', 'V', 'BABA'], '2010-01-01', '2020-12-31')
+    """
+    server, _ = start_service(PanelStore(tickers, start, end))
+    try:
+        url = server_url(server)
+        df = query_service(url, tickers, start, end, 'vol', 2)
+        query_service(url, tickers, start, end, 'vol', 2)
+        with urlopen(url + '/stats') as resp:
+            stats = json.load(resp)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(df.tail())
+    print(stats)
+
+
+if __name__ == "__main__":
+    pass
+    # _test_service(['AAPL', 'TSLA', 'V', 'BABA'], '2010-01-01', '2020-12-31')
@@ -0,0 +1,170 @@
+""" zid_project2_shm.py
+
+Shared-memory panels for process-pool workers.
+
+Sending `ret['Daily']` or `df_cha` to every worker of a process pool pickles
+the whole table for each task. Instead, the owner publishes the dense float
+array of a table once in a `multiprocessing.shared_memory` block:
+
+    >> with SharedPanel(df_cha) as panel:
+    ...     res = map_panel(func, panel.descriptor, tasks)
+
+`panel.descriptor` is a small picklable `PanelDescriptor` (block name, shape,
+dtype and labels). Each worker attaches to the block once, in the pool's
+initializer, and gets a read-only numpy view of it without copying, so tasks
+only need to carry row/column positions (e.g. bootstrap draws or the months
+of a parameter sweep).
+
+The owner unlinks the block when the `with` block exits, when `close` is
+called, or, if neither happens, when the `SharedPanel` is garbage collected
+or the interpreter exits.
+"""
+
+import weakref
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import util
+
+PanelDescriptor = namedtuple('PanelDescriptor', ['name', 'shape', 'dtype', 'index', 'columns'])
+
+# {block name: (SharedMemory, ndarray)} attached in this process
+_ATTACHED = {}
+
+# Worker state set by `_init_worker`
+_WORKER = {}
+
+
+def _release(shm):
+    shm.close()
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SharedPanel:
+    """ Owner of a shared-memory copy of the float values of a DataFrame.
+
+    Parameters
+    ----------
+    df : df
+        A table with numeric columns only, e.g. `ret['Daily']` or the output of
+        `cha_main`. It is copied into shared memory once, keeping its dtype
+        (float64 or float32).
+
+    Attributes
+    ----------
+    descriptor : PanelDescriptor
+        What workers need to attach to the block, see `attach`.
+    """
+
+    def __init__(self, df):
+        arr = df.to_numpy()
+        if not np.issubdtype(arr.dtype, np.floating):
+            raise ValueError("Only tables with float columns can be shared, got dtype {}".format(arr.dtype))
+        self._shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=self._shm.buf)[:] = arr
+        self.descriptor = PanelDescriptor(self._shm.name, arr.shape, arr.dtype.str,
+                                          df.index, list(df.columns))
+        self._finalizer = weakref.finalize(self, _release, self._shm)
+
+    def close(self):
+        """ Frees the shared-memory block. Workers must not use it afterwards. """
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach(desc):
+    """ Returns a read-only ndarray view of the shared block described by `desc`.
+    A block is attached at most once per process.
+    """
+    if desc.name not in _ATTACHED:
+        shm = shared_memory.SharedMemory(name=desc.name)
+        arr = np.ndarray(desc.shape, dtype=np.dtype(desc.dtype), buffer=shm.buf)
+        arr.flags.writeable = False
+        _ATTACHED[desc.name] = (shm, arr)
+    return _ATTACHED[desc.name][1]
+
+
+def detach(desc=None):
+    """ Closes this process's view of the block described by `desc`, or of every block if None. """
+    names = list(_ATTACHED) if desc is None else [desc.name]
+    for name in names:
+        if name in _ATTACHED:
+            shm, arr = _ATTACHED.pop(name)
+            del arr
+            shm.close()
+
+
+def as_frame(desc):
+    """ Returns the shared block described by `desc` as a read-only DataFrame, without copying. """
+    return pd.DataFrame(attach(desc), index=desc.index, columns=desc.columns, copy=False)
+
+
+def _init_worker(desc, func):
+    _WORKER['arr'] = attach(desc)
+    _WORKER['func'] = func
+
+
+def _run_task(task):
+    return _WORKER['func'](_WORKER['arr'], task)
+
+
+def map_panel(func, desc, tasks, max_workers=None, chunksize=1):
+    """ Runs `func(arr, task)` for each task on a process pool, where `arr` is the
+    shared panel described by `desc`, and returns the results in order.
+
+    Parameters
+    ----------
+    func : callable
+        A module-level function taking the (T x N) panel array and one task.
+    desc : PanelDescriptor
+        The `descriptor` of a `SharedPanel`.
+    tasks : iterable
+        Small picklable task descriptions, e.g. arrays of row positions.
+    max_workers : int, optional
+        Number of worker processes. If None, one per CPU.
+    chunksize : int
+        Number of tasks sent to a worker at a time.
+    """
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(desc, func)) as executor:
+        return list(executor.map(_run_task, tasks, chunksize=chunksize))
+
+
+def _boot_mean(arr, rows):
+    """ Mean of each column over the rows `rows`, ignoring NaN. """
+    return np.nanmean(arr[rows], axis=0)
+
+
+def _test_map_panel():
+    """ Test function for `SharedPanel` and `map_panel`: bootstraps the mean
+    monthly return of made-up portfolios, sending only row positions to the workers.
+    """
+    rng = np.random.default_rng(0)
+    idx = pd.period_range('2001-01', '2020-12', freq='M', name='Year_Month')
+    df = pd.DataFrame(rng.normal(0.01, 0.05, (len(idx), 3)), index=idx,
+                      columns=['ewp_rank_1', 'ewp_rank_2', 'ls'])
+    draws = [rng.integers(0, len(idx), len(idx)) for _ in range(200)]
+
+    with SharedPanel(df) as panel:
+        means = np.array(map_panel(_boot_mean, panel.descriptor, draws, max_workers=2, chunksize=20))
+
+    to_print = [
+        f"Sample means:\n{df.mean()}",
+        f"Bootstrap standard errors:\n{pd.Series(means.std(axis=0), index=df.columns)}",
+    ]
+    util.test_print('\n'.join(to_print))
+
+
+if __name__ == "__main__":
+    pass
+    # _test_map_panel()
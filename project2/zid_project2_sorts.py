@@ -0,0 +1,272 @@
+""" zid_project2_sorts.py
+
+Multi-key (e.g. double) portfolio sorts on the long-format table.
+
+`stock_sorting` in zid_project2_portfolio.py sorts on one characteristic with
+a per-month `qcut`. This module sorts on several characteristics, e.g. a 2x3
+size/volatility sort or a 5x5 sort, either
+    - independently: breakpoints of each key are computed per year-month, or
+    - dependently: breakpoints of each key are computed per year-month within
+      the buckets of the keys before it (e.g. volatility within size buckets).
+
+For each key, the breakpoints of all groups are computed in one grouped
+quantile call and every stock is bucketed by comparing its value with the
+breakpoint row of its group, so there are no Python loops over months or
+buckets. Bucket k holds values in (bp_k-1, bp_k], with the breakpoints of
+`pd.qcut`. When breakpoints tie, the empty buckets between them are kept,
+so bucket numbers can differ from `pd.qcut(..., duplicates='drop')`, which
+drops the duplicate edges and renumbers the remaining bins.
+
+Breakpoints can be computed on a sub-universe only (e.g. NYSE stocks, see
+`bp_universe`) and then applied to every stock.
+"""
+
+import pandas as pd
+import numpy as np
+import util
+import zid_project2_instrument as ins
+import zid_project2_tickers as tk
+
+
+def df_reshape_multi(df_cha, cha_names, mask=None):
+    """
+    Reshapes a wide table with returns and several characteristics into long format.
+
+    Parameters
+    ----------
+    df_cha : df
+        A DataFrame with a Monthly frequency PeriodIndex holding, for every ticker,
+        the monthly return column `<tic>` and one column `<tic>_<cha_name>` per
+        characteristic in `cha_names` (lagged, as produced by `merge_tables`).
+        Tables from several `cha_main` calls can be combined with `pd.concat(axis=1)`
+        after dropping the duplicated return columns.
+    cha_names : list
+        The characteristic names.
+    mask : ndarray, optional
+        A (year-month x ticker) boolean array, tickers in the order of their return
+        columns in `df_cha`. Only the cells where it is True get a row, see
+        `holding_mask` in zid_project2_universe.py. If None (the default), all cells.
+
+    Returns
+    -------
+    df
+        A DataFrame with columns 'Ret', one column per characteristic and 'ticker',
+        and a Monthly frequency PeriodIndex named 'Year_Month'. Rows are ordered
+        ticker by ticker, as in `df_reshape`. The 'ticker' column is categorical,
+        see zid_project2_tickers.py.
+    """
+    suffixes = tuple('_{}'.format(c) for c in cha_names)
+    tickers = [col for col in df_cha.columns if not col.endswith(suffixes)]
+    n_months = len(df_cha.index)
+
+    # flat positions of the kept cells, ticker by ticker
+    keep = slice(None) if mask is None else np.flatnonzero(mask.ravel(order='F'))
+
+    data = {'Ret': df_cha[tickers].to_numpy().ravel(order='F')[keep]}
+    for cha_name in cha_names:
+        cols = ['{}_{}'.format(tic, cha_name) for tic in tickers]
+        data[cha_name] = df_cha.reindex(columns=cols).to_numpy().ravel(order='F')[keep]
+    data['ticker'] = tk.tic_column(tickers, n_months)[keep]
+
+    # Taking positions of the PeriodIndex keeps its dtype even when no cell is kept
+    index = df_cha.index[np.tile(np.arange(n_months), len(tickers))[keep]]
+    return pd.DataFrame(data, index=index)
+
+
+def bp_universe(tic_exchange_dic, exchanges=('nyse',)):
+    """ Returns the tickers listed on `exchanges`, to be used as the breakpoint universe.
+
+    Parameters
+    ----------
+    tic_exchange_dic : dict
+        A dictionary with format {<tic> : <exchange>}, as returned by `get_tics`
+        in zid_project1.py (lower-case tickers and exchanges).
+    exchanges : tuple
+        Lower-case exchange names.
+
+    Returns
+    -------
+    list
+        The tickers whose exchange is in `exchanges`.
+    """
+    return [tic for tic, exchange in tic_exchange_dic.items() if exchange in exchanges]
+
+
+def breakpoints(values, group_codes, n_groups, q):
+    """ Returns the quantile breakpoints of `values` within each group.
+
+    Parameters
+    ----------
+    values : ndarray
+        Characteristic values (no NaN).
+    group_codes : ndarray
+        Integer group code of each value, in range(n_groups).
+    n_groups : int
+        Number of groups.
+    q : int
+        Number of buckets.
+
+    Returns
+    -------
+    ndarray
+        A (n_groups, q - 1) array. Row g holds the 1/q, ..., (q-1)/q quantiles
+        of the values in group g (NaN for empty groups).
+    """
+    probs = [i / q for i in range(1, q)]
+    bp = pd.Series(values).groupby(group_codes).quantile(probs).unstack()
+    return bp.reindex(range(n_groups)).to_numpy()
+
+
+def assign_buckets(values, group_codes, bp):
+    """ Returns the bucket (0, ..., q-1) of each value given the breakpoint
+    matrix `bp` from `breakpoints`. Values whose group has no breakpoints get NaN.
+
+    The bucket is the number of breakpoints of the value's group that are
+    strictly below the value, i.e. a row-wise `searchsorted(side='left')`
+    done as one broadcast comparison.
+    """
+    rows = bp[group_codes]
+    if rows.shape[1] == 0:
+        return np.zeros(len(values))
+    bucket = (values[:, None] > rows).sum(axis=1).astype(float)
+    bucket[np.isnan(rows).all(axis=1)] = np.nan
+    return bucket
+
+
+def sort_values(values, group_codes, n_groups, q, bp_mask=None):
+    """ Returns the bucket of each value within its group, with breakpoints
+    computed only on the values where `bp_mask` is True (all values if None).
+    See `breakpoints` and `assign_buckets`.
+    """
+    if bp_mask is None:
+        bp = breakpoints(values, group_codes, n_groups, q)
+    else:
+        bp = breakpoints(values[bp_mask], group_codes[bp_mask], n_groups, q)
+    return assign_buckets(values, group_codes, bp)
+
+
+@ins.timed('multi_sort')
+def multi_sort(df_long, keys, qs, dependent=False, bp_tickers=None):
+    """
+    Sorts stocks into buckets on several characteristics within each year-month.
+
+    Parameters
+    ----------
+    df_long : df
+        The output of `df_reshape_multi` (or `df_reshape` for a single key).
+    keys : list
+        Characteristic names to sort on, in order. For dependent sorts, each key
+        is sorted within the buckets of the keys before it.
+    qs : list
+        The number of buckets for each key, e.g. [2, 3] for a 2x3 sort.
+    dependent : bool
+        If True, breakpoints are conditional on the earlier keys' buckets.
+        If False (the default), each key is sorted independently within the year-month.
+    bp_tickers : list, optional
+        If given, breakpoints are computed on these tickers only (e.g. the output
+        of `bp_universe`) and applied to all stocks. Groups without any of these
+        tickers get no bucket. If None (the default), all stocks are used.
+
+    Returns
+    -------
+    df
+        `df_long` without rows that miss a return or a key, with an added
+        'rank_<key>' column (0, ..., q-1) for each key.
+    """
+    df = df_long.dropna(subset=['Ret'] + list(keys)).copy()
+    month_codes, months = pd.factorize(df.index)
+    group_codes, n_groups = month_codes, len(months)
+    bp_mask = None if bp_tickers is None else df['ticker'].isin(bp_tickers).to_numpy()
+
+    for key, q in zip(keys, qs):
+        values = df[key].to_numpy(dtype=float)
+        codes = group_codes if dependent else month_codes
+        n = n_groups if dependent else len(months)
+        bucket = sort_values(values, codes, n, q, bp_mask)
+        df['rank_{}'.format(key)] = bucket
+        if dependent:
+            # Refine the groups with this key's buckets for the next key
+            group_codes = group_codes * q + np.nan_to_num(bucket).astype(int)
+            n_groups = n_groups * q
+
+    df = df.dropna(subset=['rank_{}'.format(k) for k in keys])
+    util.color_print('multi_sort function done')
+    return df
+
+
+@ins.timed('pf_grid')
+def pf_grid(df_sorted, keys, qs):
+    """
+    Calculates equal-weighted returns of every portfolio in the sort grid and
+    the spread (long-short) return of each key.
+
+    Parameters
+    ----------
+    df_sorted : df
+        The output of `multi_sort`.
+    keys : list
+        The characteristic names used in `multi_sort`.
+    qs : list
+        The number of buckets for each key.
+
+    Returns
+    -------
+    df
+        A DataFrame with Monthly frequency PeriodIndex named 'Year_Month' and columns
+        - 'ewp_<r1>_<r2>...': the ew return of the portfolio in bucket r1 of the first key,
+          r2 of the second key, etc. (buckets numbered from 1);
+        - 'ls_<key>': for each key, the average over the buckets of the other keys of the
+          highest-bucket minus lowest-bucket portfolio return.
+    """
+    rank_cols = ['rank_{}'.format(k) for k in keys]
+    cells = df_sorted.groupby([df_sorted.index.name] + rank_cols)['Ret'].mean()
+
+    grid = cells.unstack(rank_cols)
+    full_cols = pd.MultiIndex.from_product([[float(i) for i in range(q)] for q in qs], names=rank_cols)
+    grid = grid.reindex(columns=full_cols)
+    grid.columns = ['ewp_' + '_'.join(str(int(r) + 1) for r in col) for col in full_cols]
+
+    for key, rank_col, q in zip(keys, rank_cols, qs):
+        # Buckets empty in every cell are missing from the unstacked table; their spread is NaN
+        by_key = cells.unstack(rank_col).reindex(columns=[float(i) for i in range(q)])
+        spread = by_key[float(q - 1)] - by_key[float(0)]
+        grid['ls_{}'.format(key)] = spread.groupby(level=0).mean()
+
+    util.color_print('pf_grid function done')
+    return grid
+
+
+def multi_sort_main(df_cha, keys, qs, dependent=False, bp_tickers=None):
+    """
+    Runs a multi-key sort from a wide characteristic table, see `df_reshape_multi`,
+    `multi_sort`, and `pf_grid`.
+
+    Returns
+    -------
+    df
+        The output of `pf_grid`.
+    """
+    df_long = df_reshape_multi(df_cha, keys)
+    df_sorted = multi_sort(df_long, keys, qs, dependent, bp_tickers)
+    return pf_grid(df_sorted, keys, qs)
+
+
+def _test_multi_sort():
+    """ Test function for `multi_sort` and `pf_grid`, using made-up data.
+    With a single key, `multi_sort` should reproduce the ranks of `stock_sorting`.
+    """
+    rng = np.random.default_rng(0)
+    idx = pd.period_range('2019-01', '2019-06', freq='M', name='Year_Month')
+    tics = ['stock{}'.format(i) for i in range(20)]
+    data = {tic: rng.normal(0.01, 0.05, len(idx)) for tic in tics}
+    data.update({'{}_size'.format(tic): rng.lognormal(0, 1, len(idx)) for tic in tics})
+    data.update({'{}_vol'.format(tic): rng.uniform(0.01, 0.05, len(idx)) for tic in tics})
+    df_cha = pd.DataFrame(data, index=idx)
+
+    df_grid = multi_sort_main(df_cha, ['size', 'vol'], [2, 3], dependent=True)
+    util.test_print(df_grid.T, "This means `multi_sort_main(df_cha, ['size', 'vol'], [2, 3], True).T`:")
+
+
+if __name__ == "__main__":
+    pass
+    # _test_multi_sort()
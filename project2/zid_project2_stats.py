@@ -0,0 +1,107 @@
+""" zid_project2_stats.py
+
+Per-year summary statistics of return and characteristic tables.
+
+`get_avg` in zid_project2_main.py is called for many (table, year) pairs
+when answering the questions in Part 8. Instead of masking the whole table
+for every call, `year_stats` computes the mean, median, standard deviation,
+t-stat and count of every column for every year in one groupby pass:
+
+    >> st.year_stats(df)['mean'].loc[2019]
+
+With cache=True the result is kept for as long as the table is alive, so
+later calls with the same table and calendar are lookups. The cache is keyed
+by the identity of the table and of the calendar; a table modified in place
+after its first cached lookup must be dropped from the cache with
+`clear_cache`. Without cache=True nothing is stored.
+"""
+
+import weakref
+
+import numpy as np
+import pandas as pd
+
+STATS = ('mean', 'median', 'std', 'tstat', 'count')
+
+# {(id(df), id(cal)): (weak reference to df, cal, stats, summary table)}
+_CACHE = {}
+
+
+def clear_cache(df=None):
+    """ Forgets the cached summary of `df`, or of every table if `df` is None. """
+    if df is None:
+        _CACHE.clear()
+    else:
+        for key in [key for key in _CACHE if key[0] == id(df)]:
+            _CACHE.pop(key, None)
+
+
+def year_labels(index, cal=None):
+    """ Returns the year of each row of a DatetimeIndex or PeriodIndex.
+
+    If a TradingCalendar `cal` is given (see zid_project2_calendar.py), the
+    rows of each year are found from the calendar's year boundaries, and rows
+    outside the calendar get the label -1.
+    """
+    if cal is None:
+        return np.asarray(index.year)
+    labels = np.full(len(index), -1)
+    for year in cal.years:
+        labels[cal.year_rows(index, year)] = year
+    return labels
+
+
+def year_stats(df, cal=None, cache=False, stats=STATS):
+    """ Returns per-year summary statistics of every column of `df`, ignoring missing values.
+
+    Parameters
+    ----------
+    df : df
+        A DataFrame with a DatetimeIndex or PeriodIndex, e.g. a return table of
+        `aj_ret_dict`, the output of `cha_main` or the output of `pf_main`.
+    cal : TradingCalendar, optional
+        Used to find the rows of each year, see `year_labels`. The index of `df`
+        must then be sorted.
+    cache : bool
+        If True, the result is cached for (`df`, `cal`) and a cached result is
+        returned if there is one. False (the default) stores nothing.
+    stats : tuple
+        The statistics to compute, a subset of `STATS` (all by default).
+
+    Returns
+    -------
+    df
+        A DataFrame indexed by year with two column levels, (stat, column), where
+        stat is one of `stats`; 'tstat' is mean / (std / sqrt(count)).
+
+    Examples:
+    >> stats = year_stats(df)
+    >> stats['mean'].loc[2019]      # same as get_avg(df, 2019)
+    >> stats['tstat']['ls']         # t-stat of the long-short portfolio in each year
+    """
+    stats = tuple(stat for stat in STATS if stat in stats)
+    key = (id(df), id(cal))
+    if cache and key in _CACHE:
+        ref, cached_cal, cached_stats, res = _CACHE[key]
+        if ref() is df and cached_cal is cal and set(stats) <= set(cached_stats):
+            return res.reindex(columns=list(stats), level=0)
+
+    # 'tstat' needs the mean, std and count
+    funcs = [f for f in ('mean', 'median', 'std', 'count')
+             if f in stats or ('tstat' in stats and f != 'median')]
+    labels = year_labels(df.index, cal)
+    res = df.groupby(labels).agg(funcs)
+    res.columns = res.columns.swaplevel()
+    if 'tstat' in stats:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tstat = res['mean'] / (res['std'] / np.sqrt(res['count']))
+        tstat.columns = pd.MultiIndex.from_product([['tstat'], tstat.columns])
+        res = pd.concat([res, tstat], axis=1)
+    res = res.reindex(columns=list(stats), level=0)
+    res = res[res.index != -1]
+    res.index.name = 'Year'
+
+    if cache:
+        _CACHE[key] = (weakref.ref(df), cal, stats, res)
+        weakref.finalize(df, _CACHE.pop, key, None)
+    return res
@@ -0,0 +1,99 @@
+""" zid_project2_tickers.py
+
+Shared ticker dictionary for the long-format tables.
+
+The 'ticker' column of `df_reshape`'s output repeats the ticker for every
+(year-month, ticker) row. Storing it as a pandas categorical keeps one copy of
+each ticker string (the categories) plus a small integer code per row, which
+cuts memory and makes groupby/isin hash integers instead of strings.
+
+Build the dictionary once from the `get_tics` output of zid_project1.py so all
+tables share the same categories and codes:
+
+    >> tk.build_tic_dtype(tic_exchange_dic)
+
+`portfolio_main` builds it for the duration of a run from its `tic_exchange_dic`
+argument, or from its tickers if no dictionary is set. Tables built without a
+shared dictionary use the tickers of the table itself as categories. Lookups
+such as `add_mcap` in zid_project2_weights.py join on the codes (see
+`category_positions`); use `decode_tickers` to turn the column back into
+strings for output only.
+"""
+
+import pandas as pd
+import numpy as np
+
+_TIC_DTYPE = None
+
+
+def build_tic_dtype(tic_exchange_dic):
+    """ Builds and stores the shared ticker dictionary.
+
+    Parameters
+    ----------
+    tic_exchange_dic : dict or list
+        A dictionary with format {<tic> : <exchange>}, as returned by `get_tics`,
+        or a list of tickers.
+
+    Returns
+    -------
+    CategoricalDtype
+        The dtype with the sorted (lower-case) tickers as categories.
+    """
+    global _TIC_DTYPE
+    _TIC_DTYPE = pd.CategoricalDtype(sorted(tic.lower() for tic in tic_exchange_dic))
+    return _TIC_DTYPE
+
+
+def get_tic_dtype():
+    """ Returns the shared ticker dtype, or None if `build_tic_dtype` was not called. """
+    return _TIC_DTYPE
+
+
+def set_tic_dtype(dtype):
+    """ Sets the shared ticker dtype, e.g. back to a value returned by `get_tic_dtype`. """
+    global _TIC_DTYPE
+    _TIC_DTYPE = dtype
+
+
+def reset_tic_dtype():
+    """ Forgets the shared ticker dictionary. """
+    global _TIC_DTYPE
+    _TIC_DTYPE = None
+
+
+def tic_column(tickers, n_rep):
+    """ Returns the categorical 'ticker' column of a long table whose rows are
+    `n_rep` rows for the first ticker, then `n_rep` rows for the second, etc.
+
+    Only one integer code per row is created; no ticker string is repeated.
+
+    Raises
+    ------
+    ValueError
+        If the shared dictionary is set and does not contain one of `tickers`.
+    """
+    dtype = _TIC_DTYPE if _TIC_DTYPE is not None else pd.CategoricalDtype(tickers)
+    codes = dtype.categories.get_indexer(tickers)
+    if (codes == -1).any():
+        missing = [tic for tic, c in zip(tickers, codes) if c == -1]
+        raise ValueError("Tickers {} are not in the shared ticker dictionary".format(missing))
+    return pd.Categorical.from_codes(np.repeat(codes, n_rep), dtype=dtype)
+
+
+def category_positions(tics, labels):
+    """ Returns the position in `labels` of the ticker of each element of the
+    categorical `tics`, -1 where it is missing. `labels` is looked up once per
+    category, and the rows are mapped through their integer codes.
+    """
+    tics = pd.Categorical(tics)
+    cat_pos = np.append(pd.Index(labels).get_indexer(tics.categories), -1)
+    # code -1 (missing ticker) picks the appended -1
+    return cat_pos[tics.codes]
+
+
+def decode_tickers(df, col='ticker'):
+    """ Returns a copy of `df` with the categorical column `col` as plain strings. """
+    df = df.copy()
+    df[col] = df[col].astype(str)
+    return df
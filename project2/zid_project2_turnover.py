@@ -0,0 +1,166 @@
+""" zid_project2_turnover.py
+
+Turnover and transaction-cost-adjusted returns for the quantile and long-short portfolios.
+
+The constituents of each portfolio come from the 'rank' column of `stock_sorting`'s
+output. Each quantile portfolio holds equal weights W_t in its stocks. Before trading
+in t, the weights held are last month's weights after drifting with last month's returns:
+
+    W~_t = W_t-1 * (1 + r_t-1) / sum(W_t-1 * (1 + r_t-1))
+
+Turnover in t is sum |W_t - W~_t| (buys plus sells, so a full replacement is 2 and
+the initial purchase is 1), and the cost in t is sum |W_t - W~_t| * c, where c is
+the one-way cost rate of each stock.
+
+Weights are kept sparse: one (year-month, ticker) entry per row of `stock_sorting`'s
+output, never a (year-month x ticker) matrix. The trades of t are the set difference
+of this month's and last month's constituents: the entries of W_t (+w) and of W~_t
+shifted one month forward (-w) are concatenated and summed by (year-month, ticker)
+cell, so stocks bought, sold or kept each get one entry. Memory and time grow with
+the number of sorted rows, not with months x tickers.
+"""
+
+import pandas as pd
+import numpy as np
+import util
+import zid_project2_instrument as ins
+import zid_project2_portfolio as pf
+
+
+def cost_rates(cost_bps, index, tickers, rows, cols):
+    """ Returns the one-way cost rate, in decimals, of the (year-month, ticker) cells
+    at positions (`rows`, `cols`).
+
+    Parameters
+    ----------
+    cost_bps : float or df
+        One-way transaction cost in basis points. Either a single number for all
+        stocks and months, or a DataFrame with a Monthly PeriodIndex and one column
+        per ticker (e.g. estimated half-spreads). Missing entries cost 0.
+    index : PeriodIndex
+        The year-months of the portfolios.
+    tickers : list
+        The tickers of the portfolios.
+    rows, cols : ndarray
+        Positions of the cells in `index` and `tickers`.
+    """
+    if isinstance(cost_bps, pd.DataFrame):
+        rates = cost_bps.reindex(index=index, columns=tickers).fillna(0).to_numpy(dtype=float)[rows, cols]
+    else:
+        rates = np.full(len(rows), float(cost_bps))
+    return rates / 10000
+
+
+def weight_changes(rows, cols, ret, n_rows, n_cols):
+    """ Returns the absolute change in weights |W_t - W~_t| of one quantile portfolio,
+    as sparse (year-month, ticker, trade) triplets.
+
+    Parameters
+    ----------
+    rows, cols : ndarray
+        Year-month and ticker positions of the constituents, one entry per
+        (year-month, ticker) held.
+    ret : ndarray
+        The return of each constituent in its year-month (NaN counts as 0).
+    n_rows, n_cols : int
+        The number of year-months and tickers.
+
+    Returns
+    -------
+    tuple
+        (rows, cols, trades): the cells held this month or last month, and the
+        absolute trades in them, as fractions of portfolio value.
+    """
+    n_held = np.bincount(rows, minlength=n_rows)
+    weights = 1.0 / n_held[rows]
+
+    grown = weights * (1 + np.nan_to_num(ret))
+    total = np.bincount(rows, weights=grown, minlength=n_rows)[rows]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drifted = np.where(total > 0, grown / total, 0.0)
+
+    # Last month's drifted weights are sold against this month's weights, cell by cell
+    nxt = rows + 1
+    keep = nxt < n_rows
+    keys = np.concatenate([rows * n_cols + cols, nxt[keep] * n_cols + cols[keep]])
+    delta = np.concatenate([weights, -drifted[keep]])
+    cells, inv = np.unique(keys, return_inverse=True)
+    trades = np.abs(np.bincount(inv, weights=delta))
+    return cells // n_cols, cells % n_cols, trades
+
+
+@ins.timed('pf_turnover')
+def pf_turnover(df_cha, df_sorted, cha_name, q, cost_bps=0.0):
+    """
+    Calculates turnover, trading costs and net returns of the equal-weighted
+    quantile portfolios and the long-short portfolio.
+
+    Parameters
+    ----------
+    df_cha : df
+        The output of `cha_main`, used for the year-months of the output.
+    df_sorted : df
+        The output of `stock_sorting`.
+    cha_name : str
+        The name of the characteristic.
+    q : int
+        The number of quantiles.
+    cost_bps : float or df
+        One-way transaction cost in basis points. See `cost_rates`.
+
+    Returns
+    -------
+    df
+        A DataFrame with Monthly frequency PeriodIndex named 'Year_Month' and columns
+        - 'to_rank_i', 'cost_rank_i', 'net_rank_i' for each quantile i = 1, ..., q:
+          turnover, cost and net-of-cost ew return of that quantile portfolio;
+        - 'to_ls', 'cost_ls', 'ls_net': the same for the long-short portfolio, whose
+          turnover and cost are the sums over its long and short legs.
+    """
+    index = df_cha.index
+    n_rows = len(index)
+    rows = index.get_indexer(df_sorted.index)
+    # Tickers by their category codes, see zid_project2_tickers.py
+    tics = pd.Categorical(df_sorted['ticker'])
+    cols, tickers = tics.codes, tics.categories
+    ranks = df_sorted['rank'].to_numpy(dtype=float)
+    ret = df_sorted['Ret'].to_numpy(dtype=float)
+
+    valid = ~np.isnan(ranks) & ~np.isnan(ret)
+    cells = rows[valid] * q + ranks[valid].astype(int)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gross = (np.bincount(cells, weights=ret[valid], minlength=n_rows * q) /
+                 np.bincount(cells, minlength=n_rows * q)).reshape(n_rows, q)
+
+    df = pd.DataFrame(index=index)
+    for i in range(q):
+        held = ranks == i
+        t, j, trades = weight_changes(rows[held], cols[held], ret[held], n_rows, len(tickers))
+        cost = trades * cost_rates(cost_bps, index, tickers, t, j)
+        df['to_rank_{}'.format(i + 1)] = np.bincount(t, weights=trades, minlength=n_rows)
+        df['cost_rank_{}'.format(i + 1)] = np.bincount(t, weights=cost, minlength=n_rows)
+        df['net_rank_{}'.format(i + 1)] = gross[:, i] - df['cost_rank_{}'.format(i + 1)]
+
+    df['to_ls'] = df['to_rank_{}'.format(q)] + df['to_rank_1']
+    df['cost_ls'] = df['cost_rank_{}'.format(q)] + df['cost_rank_1']
+    df['ls_net'] = gross[:, q - 1] - gross[:, 0] - df['cost_ls']
+
+    df = df[~np.isnan(gross).all(axis=1)]
+    util.color_print('pf_turnover function done')
+    return df
+
+
+def _test_pf_turnover(df_cha, cha_name, q):
+    """ Test function for `pf_turnover`
+
+    >> made_up_df_cha = pf._test_df_cha_gen()
+    >> _test_pf_turnover(made_up_df_cha, 'cha_name', 2)
+    """
+    df_sorted = pf.stock_sorting(pf.df_reshape(df_cha, cha_name), cha_name, q)
+    df_to = pf_turnover(df_cha, df_sorted, cha_name, q, cost_bps=10)
+    util.test_print(df_to.T, "This means `pf_turnover(df_cha, df_sorted, cha_name, q, cost_bps=10).T`:")
+
+
+if __name__ == "__main__":
+    pass
+    # _test_pf_turnover(pf._test_df_cha_gen(), 'cha_name', 2)
@@ -0,0 +1,146 @@
+""" zid_project2_universe.py
+
+Declarative universe filter for the characteristic sorts.
+
+A `UniverseRule` lists the requirements a stock must meet in a year-month to
+be sorted in the next one:
+
+    min_price    the last Close of the month is at least this
+    min_volume   the average daily Volume of the month is at least this
+    min_history  the stock has prices in at least this many months so far
+                 (including this one)
+    exchanges    the exchange of the stock (from `get_tics` in zid_project1.py)
+                 is one of these
+
+Requirements left as None are not checked. `eligibility` evaluates the rule
+on the daily Close and Volume panels (see `ohlc_panel` in zid_project2_ohlc.py)
+with grouped reductions over the trading calendar, and returns a boolean
+(year-month x ticker) matrix. Months without a price are not eligible.
+
+The matrix is used in two places:
+    - `eligible_tickers` gives the stocks eligible in at least one month, so
+      the others need not be loaded by `aj_ret_dict` at all;
+    - `pf_main(..., eligible=...)` keeps only the eligible (year-month, ticker)
+      cells when it reshapes the characteristic table to long format, so
+      ineligible stocks never get a row in the sorts. Eligibility in month t-1
+      applies to the month t row, like the characteristic itself.
+
+    >> rule = UniverseRule(min_price=5, min_volume=1e5, min_history=12, exchanges=('nyse', 'nasdaq'))
+    >> panel = oh.ohlc_panel(tickers, DATDIR, start, end, fields=('Close', 'Volume'))
+    >> elig = eligibility(panel, rule, tic_exchange_dic)
+    >> ret = etl.aj_ret_dict(eligible_tickers(elig), start, end)
+    >> df_pf = pf.pf_main(cha.cha_main(ret, 'vol', ['Daily',]), 'vol', 3, eligible=elig)
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import util
+import zid_project2_calendar as cd
+import zid_project2_instrument as ins
+import zid_project2_precision as pr
+
+UniverseRule = namedtuple('UniverseRule', ['min_price', 'min_volume', 'min_history', 'exchanges'],
+                          defaults=(None, None, None, None))
+
+
+@ins.timed('eligibility')
+def eligibility(panel, rule, tic_exchange_dic=None, cal=None):
+    """
+    Evaluates a universe rule for every year-month and ticker.
+
+    Parameters
+    ----------
+    panel : dict
+        Daily wide tables {'Close': <df>, 'Volume': <df>} with a DatetimeIndex and
+        one column per ticker, e.g. the output of `ohlc_panel` in zid_project2_ohlc.py.
+        'Volume' is only needed with `rule.min_volume`.
+    rule : UniverseRule
+        The requirements.
+    tic_exchange_dic : dict, optional
+        A dictionary with format {<tic> : <exchange>}, as returned by `get_tics`.
+        Needed with `rule.exchanges`.
+    cal : TradingCalendar, optional
+        The trading calendar of the panel (see zid_project2_calendar.py).
+        If None, it is built from the dates of 'Close'.
+
+    Returns
+    -------
+    df
+        A boolean DataFrame with a Monthly frequency PeriodIndex named 'Year_Month'
+        and the tickers of 'Close' as columns.
+
+    Raises
+    ------
+    ValueError
+        If the panel or `tic_exchange_dic` lacks the data a requirement needs.
+    """
+    close = panel['Close']
+    cal = cd.TradingCalendar(close.index) if cal is None else cal
+    codes = cal.month_ids(close.index)
+    n_months = cal.n_months
+
+    # Months in which each stock has a price
+    has_price = close.notna().groupby(codes).any().reindex(range(n_months), fill_value=False).to_numpy()
+    elig = has_price.copy()
+
+    if rule.min_price is not None:
+        last = close.groupby(codes).last().reindex(range(n_months)).to_numpy()
+        with np.errstate(invalid='ignore'):
+            elig &= last >= rule.min_price
+
+    if rule.min_volume is not None:
+        if 'Volume' not in panel:
+            raise ValueError("`min_volume` needs the 'Volume' panel")
+        volume = panel['Volume'].reindex(index=close.index, columns=close.columns).to_numpy()
+        avg, _ = pr.grouped_mean(volume, codes, n_months)
+        with np.errstate(invalid='ignore'):
+            elig &= avg >= rule.min_volume
+
+    if rule.min_history is not None:
+        elig &= np.cumsum(has_price, axis=0) >= rule.min_history
+
+    if rule.exchanges is not None:
+        if tic_exchange_dic is None:
+            raise ValueError("`exchanges` needs `tic_exchange_dic`")
+        exchanges = {exchange.lower() for exchange in rule.exchanges}
+        elig &= np.array([tic_exchange_dic.get(tic.lower()) in exchanges for tic in close.columns])
+
+    df = pd.DataFrame(elig, index=cal.months, columns=close.columns)
+    util.color_print('eligibility function done')
+    return df
+
+
+def eligible_tickers(eligible):
+    """ Returns the tickers that are eligible in at least one year-month. """
+    return list(eligible.columns[eligible.to_numpy().any(axis=0)])
+
+
+def holding_mask(eligible, index, tickers):
+    """ Returns the (len(index) x len(tickers)) boolean array of the cells of a
+    `merge_tables`-style table (characteristics of month t-1 on the month t row)
+    whose stock was eligible in the previous month. Months or tickers missing
+    from `eligible` are not eligible.
+    """
+    prev = pd.PeriodIndex(index, freq='M') - 1
+    return eligible.reindex(index=prev, columns=[tic.lower() for tic in tickers], fill_value=False)\
+        .to_numpy(dtype=bool)
+
+
+def _test_eligibility(tickers, datdir, start, end):
+    """ Test function for `eligibility`. Prints the number of eligible stocks per month.
+
+    >> _test_eligibility(['AAPL', 'DIS', 'TSLA'], '../project1/project1/data', '2010-01-01', '2012-12-31')
+    """
+    import zid_project2_ohlc as oh
+
+    panel = oh.ohlc_panel(tickers, datdir, start, end, fields=('Close', 'Volume'))
+    rule = UniverseRule(min_price=20, min_volume=100, min_history=6)
+    elig = eligibility(panel, rule)
+    util.test_print(elig.sum(axis=1).to_frame('n_eligible').T, "This means `eligibility(panel, {})`:".format(rule))
+
+
+if __name__ == "__main__":
+    pass
+    # _test_eligibility(['AAPL', 'DIS', 'TSLA'], '../project1/project1/data', '2010-01-01', '2012-12-31')
@@ -0,0 +1,193 @@
+""" zid_project2_weights.py
+
+Weighting engine for the portfolio stage.
+
+`pf_cal` in zid_project2_portfolio.py builds equal-weighted portfolios only.
+`pf_cal_weighted` builds any combination of the weighting schemes below from
+the same sorted table, in a single grouped reduction: for every scheme it
+adds a weight column w and a weighted-return column w * Ret, sums all of
+them by (year-month, rank) in one groupby, and divides. Adding schemes
+therefore adds columns to one pass instead of extra passes.
+
+Weighting schemes:
+    'ew' : equal weights
+    'vw' : lagged market capitalisation (month-end Close x shares outstanding)
+    'iv' : inverse of the lagged volatility characteristic
+    'rw' : cross-sectional rank of the characteristic within the year-month
+"""
+
+import pandas as pd
+import numpy as np
+import util
+import zid_project2_instrument as ins
+import zid_project2_tickers as tk
+
+WEIGHT_SCHEMES = ('ew', 'vw', 'iv', 'rw')
+
+
+def lagged_mcap(close_m, shares):
+    """ Returns lagged market capitalisation for each stock and year-month.
+
+    Parameters
+    ----------
+    close_m : df
+        Month-end (unadjusted) Close prices, with a Monthly frequency PeriodIndex
+        and one column per ticker.
+    shares : ser or df
+        Shares outstanding, either a Series indexed by ticker (constant over time)
+        or a DataFrame shaped like `close_m`.
+
+    Returns
+    -------
+    df
+        Close x shares shifted 1 month forward, so the row for a year-month holds
+        the market capitalisation at the end of the previous year-month.
+        It has the same index and columns as `close_m`.
+    """
+    return close_m.mul(shares).shift(1)
+
+
+def add_mcap(df_sorted, df_mcap):
+    """ Adds an 'mcap' column to the long table `df_sorted` by looking up
+    each (year-month, ticker) row in the wide table `df_mcap`.
+
+    Parameters
+    ----------
+    df_sorted : df
+        The output of `stock_sorting` in zid_project2_portfolio.py.
+    df_mcap : df
+        Lagged market capitalisation, see `lagged_mcap`.
+
+    Returns
+    -------
+    df
+        A copy of `df_sorted` with an added 'mcap' column (NaN where missing).
+    """
+    # Join on the ticker category codes: no ticker string is built per row
+    rows = df_mcap.index.get_indexer(df_sorted.index)
+    cols = tk.category_positions(df_sorted['ticker'], df_mcap.columns)
+    found = (rows >= 0) & (cols >= 0)
+    mcap = np.full(len(df_sorted), np.nan)
+    mcap[found] = df_mcap.to_numpy(dtype=float)[rows[found], cols[found]]
+
+    df = df_sorted.copy()
+    df['mcap'] = mcap
+    return df
+
+
+def pf_weights(df_sorted, cha_name, schemes, iv_col=None):
+    """ Returns the (unnormalised) weight of each row of `df_sorted` under each scheme.
+
+    Parameters
+    ----------
+    df_sorted : df
+        The output of `stock_sorting`, with an 'mcap' column if 'vw' is requested.
+    cha_name : str
+        The name of the sorting characteristic, used by 'rw'.
+    schemes : list
+        Weighting schemes, a subset of `WEIGHT_SCHEMES`.
+    iv_col : str, optional
+        The column holding lagged volatility, used by 'iv'. If None, `cha_name`.
+
+    Returns
+    -------
+    df
+        One column per scheme, same index as `df_sorted`. Rows with a missing or
+        non-positive weight get a weight of 0 under that scheme.
+
+    Raises
+    ------
+    ValueError
+        If a scheme is unknown, or 'iv' is requested and `iv_col` is not a column of `df_sorted`.
+    """
+    iv_col = cha_name if iv_col is None else iv_col
+    if 'iv' in schemes and iv_col not in df_sorted.columns:
+        raise ValueError("'iv' weights need a volatility column, but '{}' is not in `df_sorted`".format(iv_col))
+    weights = {}
+    for scheme in schemes:
+        if scheme == 'ew':
+            w = pd.Series(1.0, index=df_sorted.index)
+        elif scheme == 'vw':
+            w = df_sorted['mcap']
+        elif scheme == 'iv':
+            w = 1 / df_sorted[iv_col]
+        elif scheme == 'rw':
+            w = df_sorted.groupby(level=0)[cha_name].rank()
+        else:
+            raise ValueError("Unknown weighting scheme '{}', use one of {}".format(scheme, WEIGHT_SCHEMES))
+        weights[scheme] = w.where(w > 0, 0.0).replace(np.inf, 0.0)
+    return pd.DataFrame(weights, index=df_sorted.index)
+
+
+@ins.timed('pf_cal_weighted')
+def pf_cal_weighted(df_sorted, cha_name, q, schemes=WEIGHT_SCHEMES, df_mcap=None, iv_col=None):
+    """
+    Calculates quantile and long-short portfolio returns under several weighting schemes at once.
+
+    Parameters
+    ----------
+    df_sorted : df
+        The output of `stock_sorting` in zid_project2_portfolio.py.
+    cha_name : str
+        The name of the characteristic.
+    q : int
+        The number of quantiles that the stocks in `df_sorted` been divided into.
+    schemes : list
+        Weighting schemes, a subset of `WEIGHT_SCHEMES`.
+    df_mcap : df, optional
+        Lagged market capitalisation (see `lagged_mcap`). Required for 'vw'.
+    iv_col : str, optional
+        The column of `df_sorted` holding lagged volatility, used by 'iv'. If None, `cha_name`.
+
+    Returns
+    -------
+    df
+        A DataFrame with Monthly frequency PeriodIndex named 'Year_Month'.
+        - For 'ew', the columns are the same as those of `pf_cal`:
+          'ewp_rank_1', ..., 'ewp_rank_{q}' and 'ls'.
+        - For every other scheme `s`: '{s}p_rank_1', ..., '{s}p_rank_{q}' and 'ls_{s}'.
+
+    Examples:
+    >> made_up_df_cha = pf._test_df_cha_gen()
+    >> df_sorted = pf.stock_sorting(pf.df_reshape(made_up_df_cha, 'cha_name'), 'cha_name', 2)
+    >> pf_cal_weighted(df_sorted, 'cha_name', 2, schemes=['ew', 'rw']).T
+        Year_Month   2019-02   2019-03
+        ewp_rank_1  0.009787  0.021589
+        ewp_rank_2 -0.041856 -0.033529
+        ls         -0.051642 -0.055117
+        rwp_rank_1  0.008219  0.024850
+        rwp_rank_2 -0.041856 -0.035214
+        ls_rw      -0.050075 -0.060064
+    """
+    if 'vw' in schemes:
+        if df_mcap is None:
+            raise ValueError("`df_mcap` is required for value-weighted portfolios")
+        df_sorted = add_mcap(df_sorted, df_mcap)
+
+    weights = pf_weights(df_sorted, cha_name, schemes, iv_col)
+    w_cols = ['{}_w'.format(s) for s in schemes]
+    wr_cols = ['{}_wr'.format(s) for s in schemes]
+
+    tbl = pd.DataFrame(weights.to_numpy(), index=df_sorted.index, columns=w_cols)
+    ret = df_sorted['Ret'].to_numpy()[:, None]
+    tbl[wr_cols] = np.where(tbl[w_cols].to_numpy() > 0, tbl[w_cols].to_numpy() * ret, 0.0)
+    tbl['rank'] = df_sorted['rank']
+
+    # One grouped reduction for every scheme
+    sums = tbl.groupby([tbl.index.name, 'rank'])[w_cols + wr_cols].sum()
+    pf_ret = pd.DataFrame(sums[wr_cols].to_numpy() / sums[w_cols].to_numpy(),
+                          index=sums.index, columns=list(schemes))
+
+    lst = []
+    for scheme in schemes:
+        temp = pf_ret[scheme].unstack('rank').reindex(columns=[float(i) for i in range(q)])
+        temp.columns = ['{}p_rank_{}'.format(scheme, i + 1) for i in range(q)]
+        ls_name = 'ls' if scheme == 'ew' else 'ls_{}'.format(scheme)
+        temp[ls_name] = temp['{}p_rank_{}'.format(scheme, q)] - temp['{}p_rank_1'.format(scheme)]
+        lst += [temp]
+
+    df = pd.concat(lst, axis=1)
+    df.columns.name = None
+
+    util.color_print('pf_cal_weighted function done')
+    return df
@@ -0,0 +1,194 @@
+""" zid_project2_xsection.py
+
+Cross-sectional preprocessing of characteristics before sorting.
+
+`stock_sorting` cuts the raw characteristic values, so a few extreme values
+(e.g. the volatility of a stock in its listing month) can stretch the
+breakpoints. This stage transforms each characteristic within each
+year-month before the sort:
+
+    'winsorize'  clip at the `lower` and `upper` percentiles of the month
+    'zscore'     subtract the month mean and divide by the month std
+    'rank'       replace by the percentile rank in the month, in (0, 1]
+
+Each step is computed for all months at once: the values are sorted by
+(month, value) with one `np.lexsort`, and the per-month quantiles and ranks
+are read off the sorted array by position; means and standard deviations are
+grouped sums (see `grouped_mean` and `grouped_std` in zid_project2_precision.py).
+No Python function is called per month.
+
+The results match the pandas equivalents, i.e.
+`groupby(level=0).transform(...)` with `clip(x.quantile(lower), x.quantile(upper))`,
+`(x - x.mean()) / x.std()` and `x.rank(pct=True)`. NaN values stay NaN and are
+not counted. Only rows with a value enter the month's cross-section, whether
+or not they have a return.
+
+    >> df_pf = pf.pf_main(df_cha, 'vol', 3, preprocess=['winsorize', 'zscore'])
+"""
+
+import numpy as np
+import pandas as pd
+import util
+import zid_project2_instrument as ins
+import zid_project2_precision as pr
+
+CS_STEPS = ('winsorize', 'zscore', 'rank')
+
+# Default winsorization percentiles
+WINSOR_PCT = (0.01, 0.99)
+
+
+def sorted_groups(values, codes, n_groups):
+    """ Sorts `values` by (group, value) with the NaN values of each group last.
+
+    Returns
+    -------
+    tuple
+        (order, start, count): `values[order]` is the sorted array, the sorted
+        values of group g are at positions start[g], ..., start[g] + count[g] - 1,
+        and count[g] is the number of non-NaN values of group g.
+    """
+    order = np.lexsort((values, codes))
+    size = np.bincount(codes, minlength=n_groups)
+    start = np.concatenate(([0], np.cumsum(size)[:-1]))
+    count = np.bincount(codes[~np.isnan(values)], minlength=n_groups)
+    return order, start, count
+
+
+def grouped_quantile(values, codes, n_groups, p, groups=None):
+    """ Returns the `p` quantile of `values` within each group, with linear
+    interpolation as in `pd.Series.quantile` (NaN for groups without values).
+    `groups` is the output of `sorted_groups`, computed if None.
+    """
+    order, start, count = sorted_groups(values, codes, n_groups) if groups is None else groups
+    s = values[order]
+    h = np.maximum(count - 1, 0) * p
+    lo = np.floor(h).astype(np.int64)
+    hi = np.minimum(lo + 1, np.maximum(count - 1, 0))
+    empty = count == 0
+    # Empty groups point at position 0 and are set to NaN below
+    lo_pos = np.where(empty, 0, start + lo)
+    hi_pos = np.where(empty, 0, start + hi)
+    res = s[lo_pos] + (h - lo) * (s[hi_pos] - s[lo_pos])
+    res[empty] = np.nan
+    return res
+
+
+def winsorize(values, codes, n_groups, lower=WINSOR_PCT[0], upper=WINSOR_PCT[1], groups=None):
+    """ Returns `values` clipped at the `lower` and `upper` quantiles of their group. """
+    groups = sorted_groups(values, codes, n_groups) if groups is None else groups
+    lo = grouped_quantile(values, codes, n_groups, lower, groups)
+    hi = grouped_quantile(values, codes, n_groups, upper, groups)
+    return np.clip(values, lo[codes], hi[codes])
+
+
+def zscore(values, codes, n_groups, ddof=1):
+    """ Returns `values` standardised by the mean and standard deviation of their group
+    (NaN where the group has ddof values or fewer).
+    """
+    col = values[:, None]
+    mean, _ = pr.grouped_mean(col, codes, n_groups)
+    std, _ = pr.grouped_std(col, codes, n_groups, ddof)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (values - mean[codes, 0]) / std[codes, 0]
+
+
+def rank_normalize(values, codes, n_groups, groups=None):
+    """ Returns the percentile rank of `values` within their group, in (0, 1].
+    Ties get their average rank, as in `pd.Series.rank(pct=True)`.
+    """
+    order, start, count = sorted_groups(values, codes, n_groups) if groups is None else groups
+    s = values[order]
+    c = codes[order]
+    valid = ~np.isnan(s)
+
+    # Runs of equal values within a group; each run gets the average of its positions
+    new_run = np.ones(len(s), dtype=bool)
+    new_run[1:] = (c[1:] != c[:-1]) | (s[1:] != s[:-1])
+    run_id = np.cumsum(new_run) - 1
+    pos = np.arange(len(s))
+    first = pos[new_run]
+    last = np.append(first[1:], len(s)) - 1
+    avg_rank = (first + last)[run_id] / 2 - start[c] + 1
+
+    rank = np.full(len(values), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rank[order[valid]] = avg_rank[valid] / count[c[valid]]
+    return rank
+
+
+def cs_values(values, codes, n_groups, steps, winsor_pct=WINSOR_PCT):
+    """ Applies the preprocessing `steps` (in order, see `CS_STEPS`) to `values`
+    within the groups given by `codes`. The result has the dtype of `values`;
+    the computation is done in float64.
+    """
+    unknown = [step for step in steps if step not in CS_STEPS]
+    if unknown:
+        raise ValueError("Unknown preprocessing steps {}, use {}".format(unknown, list(CS_STEPS)))
+    x = values.astype(np.float64)
+    for step in steps:
+        if step == 'winsorize':
+            x = winsorize(x, codes, n_groups, *winsor_pct)
+        elif step == 'zscore':
+            x = zscore(x, codes, n_groups)
+        else:
+            x = rank_normalize(x, codes, n_groups)
+    return x.astype(values.dtype)
+
+
+@ins.timed('cs_transform')
+def cs_transform(df_long, cols, steps, winsor_pct=WINSOR_PCT):
+    """
+    Transforms characteristics cross-sectionally within each year-month.
+
+    Parameters
+    ----------
+    df_long : df
+        A long table with a Monthly frequency PeriodIndex, e.g. the output of
+        `df_reshape` in zid_project2_portfolio.py or `df_reshape_multi` in
+        zid_project2_sorts.py.
+    cols : list
+        The characteristic columns to transform.
+    steps : list
+        Steps applied in order, a sequence of 'winsorize', 'zscore' and 'rank'.
+    winsor_pct : tuple
+        The (lower, upper) percentiles of 'winsorize', as fractions.
+
+    Returns
+    -------
+    df
+        A copy of `df_long` with the columns in `cols` transformed.
+    """
+    month_codes, months = pd.factorize(df_long.index)
+    df = df_long.copy()
+    for col in cols:
+        df[col] = cs_values(df[col].to_numpy(), month_codes, len(months), steps, winsor_pct)
+
+    util.color_print('cs_transform function done')
+    return df
+
+
+def _test_cs_transform():
+    """ Test function for `cs_transform`, using made-up data. Compares each
+    step with the pandas `groupby().transform` equivalent.
+    """
+    rng = np.random.default_rng(0)
+    idx = pd.PeriodIndex(np.repeat(pd.period_range('2019-01', '2019-12', freq='M'), 50), name='Year_Month')
+    vol = rng.lognormal(-4, 1, len(idx))
+    vol[rng.random(len(idx)) < 0.1] = np.nan
+    vol[::7] = 0.02  # ties
+    df = pd.DataFrame({'Ret': rng.normal(0, 0.05, len(idx)), 'vol': vol}, index=idx)
+    by = df.groupby(level=0)['vol']
+    pandas_res = {
+        'winsorize': by.transform(lambda x: x.clip(x.quantile(0.05), x.quantile(0.95))),
+        'zscore': by.transform(lambda x: (x - x.mean()) / x.std()),
+        'rank': by.rank(pct=True),
+    }
+    for step, expected in pandas_res.items():
+        res = cs_transform(df, ['vol'], [step], winsor_pct=(0.05, 0.95))
+        print(step, 'max abs diff:', np.nanmax(np.abs(res['vol'] - expected)))
+
+
+if __name__ == "__main__":
+    pass
+    # _test_cs_transform()
@@ -0,0 +1,221 @@
+""" yf_bulk.py
+Bulk, resumable download of stock prices into CSV files.
+
+Each download is a "job" identified by a key (e.g. 'QAN.AX' or 'qan_2020').
+Jobs run on a bounded thread pool, failed downloads are retried with
+exponential backoff, and every finished job is recorded in a JSON checkpoint
+file so an interrupted run picks up where it stopped.
+
+The fetcher is pluggable: any callable `fetcher(tic, start=None, end=None)`
+returning a DataFrame indexed by 'Date' can replace the Yahoo Finance download,
+e.g. `csv_dir_fetcher` (fixture folder) or `http_fetcher` (local test server).
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+
+import pandas as pd
+
+from yf_example2 import yf_prc_to_csv, yf_prc_refresh
+
+
+def csv_dir_fetcher(src_dir):
+    """ Returns a fetcher that reads prices from `<src_dir>/<tic>.csv`
+    instead of downloading them.
+
+    Parameters
+    ----------
+    src_dir : str
+        Folder containing one CSV file per ticker, in the format written by
+        `yf_prc_to_csv`
+
+    Returns
+    -------
+    callable
+        A function with the same signature as `yf_example2.yf_download`
+    """
+    def fetcher(tic, start=None, end=None):
+        df = pd.read_csv(os.path.join(src_dir, f'{tic}.csv'), index_col='Date', parse_dates=['Date'])
+        return df.loc[start:end]
+    return fetcher
+
+
+def http_fetcher(base_url):
+    """ Returns a fetcher that reads prices from `<base_url>/<tic>.csv?start=..&end=..`.
+    Useful to test the downloader against a local stand-in server.
+
+    Parameters
+    ----------
+    base_url : str
+        Server address, e.g. 'http://127.0.0.1:8000'
+
+    Returns
+    -------
+    callable
+        A function with the same signature as `yf_example2.yf_download`
+    """
+    def fetcher(tic, start=None, end=None):
+        qry = urlencode({k: v for k, v in (('start', start), ('end', end)) if v is not None})
+        url = f'{base_url.rstrip("/")}/{tic}.csv' + (f'?{qry}' if qry else '')
+        return pd.read_csv(url, index_col='Date', parse_dates=['Date'])
+    return fetcher
+
+
+def read_checkpoint(pth):
+    """ Returns the checkpoint dictionary saved at `pth`, or an empty
+    dictionary if there is no checkpoint yet.
+
+    The checkpoint has format {<key> : {'tic': <tic>, 'start': <start>, 'end': <end>,
+    'pth': <csv path>, 'rows': <rows written>}}
+    """
+    if pth is None or not os.path.exists(pth):
+        return {}
+    with open(pth, 'r') as file:
+        return json.load(file)
+
+
+def write_checkpoint(done, pth):
+    """ Saves the checkpoint dictionary `done` to `pth`.
+    The file is written to a temporary location first and then renamed, so a
+    crash never leaves a half-written checkpoint behind.
+    """
+    tmp = f'{pth}.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(done, file, indent=2)
+    os.replace(tmp, pth)
+
+
+def job_done(entry, tic, start, end, pth):
+    """ Returns True if the checkpoint `entry` records the job (`tic`, `start`, `end`, `pth`)
+    and its CSV file still exists. Entries of a job with other parameters (e.g. a
+    different date range), or written before the parameters were recorded, do not match.
+    """
+    if entry is None or 'tic' not in entry:
+        return False
+    recorded = (entry['tic'], entry.get('start'), entry.get('end'), entry['pth'])
+    return recorded == (tic, start, end, pth) and os.path.exists(pth)
+
+
+def run_with_retry(func, retries=3, backoff=1.0):
+    """ Calls `func()` and returns its result, retrying up to `retries` times
+    if it raises. The wait before retry `i` (starting at 0) is `backoff * 2**i` seconds.
+    The exception from the last attempt is re-raised.
+    """
+    for i in range(retries + 1):
+        try:
+            return func()
+        except Exception:
+            if i == retries:
+                raise
+            time.sleep(backoff * 2 ** i)
+
+
+def run_jobs(jobs, fetcher=None, max_workers=8, retries=3, backoff=1.0, ckpt_pth=None, refresh=False):
+    """ Downloads a set of price jobs concurrently and saves each one to CSV.
+
+    Parameters
+    ----------
+    jobs : dict
+        A dictionary with format {<key> : (<tic>, <start>, <end>, <pth>)}, where
+        <pth> is the location of the output CSV file for this job.
+
+    fetcher : callable, optional
+        A function with the same signature as `yf_example2.yf_download`.
+        If None (the default), prices are downloaded from Yahoo Finance.
+
+    max_workers : int
+        Maximum number of downloads running at the same time
+
+    retries : int
+        Number of retries for each job before it is reported as failed
+
+    backoff : float
+        Base wait, in seconds, of the exponential backoff between retries
+
+    ckpt_pth : str, optional
+        Location of the JSON checkpoint file. Jobs recorded there with the same
+        ticker, start, end and CSV path, whose CSV file still exists, are skipped
+        (see `job_done`). If None, nothing is checkpointed.
+
+    refresh : bool
+        If True, existing CSV files are brought up to date with
+        `yf_example2.yf_prc_refresh` (only missing rows are fetched and appended)
+        and the checkpoint is ignored, since every file may have new rows.
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<key> : <status>}, where <status> is
+        'skipped', 'done', or the error message of a failed job.
+    """
+    done = {} if refresh else read_checkpoint(ckpt_pth)
+    lock = threading.Lock()
+    status = {}
+
+    todo = {}
+    for key, job in jobs.items():
+        if job_done(done.get(key), *job):
+            status[key] = 'skipped'
+        else:
+            todo[key] = job
+
+    def _run(key, tic, start, end, pth):
+        if refresh and os.path.exists(pth):
+            task = lambda: yf_prc_refresh(tic, pth, end=end, fetcher=fetcher)
+        else:
+            task = lambda: yf_prc_to_csv(tic, pth, start=start, end=end, fetcher=fetcher)
+        rows = run_with_retry(task, retries=retries, backoff=backoff)
+        if ckpt_pth is not None:
+            with lock:
+                done[key] = {'tic': tic, 'start': start, 'end': end, 'pth': pth, 'rows': rows}
+                write_checkpoint(done, ckpt_pth)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(_run, key, *job): key for key, job in todo.items()}
+        for fut in as_completed(futures):
+            key = futures[fut]
+            err = fut.exception()
+            status[key] = 'done' if err is None else f'{type(err).__name__}: {err}'
+
+    return status
+
+
+def bulk_prc_to_csv(tics, dst_dir, start=None, end=None, fetcher=None,
+                    max_workers=8, retries=3, backoff=1.0, ckpt_pth=None, refresh=False):
+    """ Downloads prices for many tickers and saves them to `<dst_dir>/<tic>.csv`.
+
+    This replaces looping over `yf_example2.yf_prc_to_csv`. See `run_jobs` for
+    a description of the scheduling, retry, and checkpoint parameters.
+    If `ckpt_pth` is None, the checkpoint is kept in `<dst_dir>/_checkpoint.json`.
+
+    Returns
+    -------
+    dict
+        A dictionary with format {<tic> : <status>}, see `run_jobs`
+    """
+    if not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    if ckpt_pth is None:
+        ckpt_pth = os.path.join(dst_dir, '_checkpoint.json')
+    jobs = {tic: (tic, start, end, os.path.join(dst_dir, f'{tic}.csv')) for tic in tics}
+    return run_jobs(jobs, fetcher=fetcher, max_workers=max_workers,
+                    retries=retries, backoff=backoff, ckpt_pth=ckpt_pth, refresh=refresh)
+
+
+def _test_bulk_prc_to_csv(src_dir, dst_dir):
+    """ Test function for `bulk_prc_to_csv`. Copies the fixture CSV files in
+    `src_dir` to `dst_dir` without using the network. Running it a second time
+    should report every ticker as 'skipped'.
+    """
+    tics = [f[:-4] for f in sorted(os.listdir(src_dir)) if f.endswith('.csv')]
+    status = bulk_prc_to_csv(tics, dst_dir, fetcher=csv_dir_fetcher(src_dir), max_workers=4)
+    print(status)
+
+
+if __name__ == "__main__":
+    pass
+    # _test_bulk_prc_to_csv('data', 'data_bulk')
@@ -1,9 +1,42 @@
 """ yf_example2.py
 Example of a function to download stock prices from Yahoo Finance.
 """
-import yfinance as yf
+import datetime as dt
+import os
 
-def yf_prc_to_csv(tic, pth, start=None, end=None):
+
+def yf_download(tic, start=None, end=None):
+    """ Downloads stock prices for a single ticker from Yahoo Finance.
+
+    This is the default fetcher used by `yf_prc_to_csv` and by the bulk
+    downloader in yf_bulk.py. Any callable with the same signature that returns
+    a DataFrame indexed by 'Date' can be used in its place.
+
+    Parameters
+    ----------
+    tic : str
+        Ticker
+
+    start: str, optional
+        Download start date string (YYYY-MM-DD)
+
+    end: str, optional
+        Download end date string (YYYY-MM-DD)
+
+    Returns
+    -------
+    df
+        A DataFrame with the downloaded prices
+
+    Note: yfinance is imported here rather than at module load, so modules
+    that only use other fetchers do not pay for importing it.
+    """
+    import yfinance as yf
+
+    return yf.download(tic, start=start, end=end, ignore_tz=True)
+
+
+def yf_prc_to_csv(tic, pth, start=None, end=None, fetcher=None):
     """ Downloads stock prices from Yahoo Finance and saves the
     information in a CSV file
 
@@ -22,13 +55,164 @@ def yf_prc_to_csv(tic, pth, start=None, end=None):
     end: str, optional
         Download end date string (YYYY-MM-DD)
         If None (the default), end is set to the most current date available
+
+    fetcher: callable, optional
+        A function with the same signature as `yf_download`.
+        If None (the default), prices are downloaded from Yahoo Finance
+
+    Returns
+    -------
+    int
+        The number of rows written to `pth`
     """
-    df = yf.download(tic, start=start, end=end, ignore_tz=True)
+    if fetcher is None:
+        fetcher = yf_download
+    df = fetcher(tic, start=start, end=end)
     df.to_csv(pth)
+    return len(df)
+
+
+def last_stored_date(pth, blocksize=4096):
+    """ Returns the date in the last complete row of the price CSV file at `pth`.
+
+    Only the end of the file is read: blocks of `blocksize` bytes are read
+    backwards from the end until a complete last line is found. A last line
+    without a terminating newline (e.g. left by a crash during an append) is
+    not a stored row and is ignored.
+
+    Parameters
+    ----------
+    pth : str
+        Location of a CSV file written by `yf_prc_to_csv`, with the date
+        (YYYY-MM-DD) in the first column
+
+    Returns
+    -------
+    datetime.date or None
+        The last stored date, or None if the file has no data rows
+    """
+    with open(pth, 'rb') as file:
+        file.seek(0, os.SEEK_END)
+        pos = file.tell()
+        tail = b''
+        while pos > 0:
+            step = min(blocksize, pos)
+            pos -= step
+            file.seek(pos)
+            tail = file.read(step) + tail
+            # A complete last line and the start of the line before it
+            if tail.rstrip(b'\n').count(b'\n') >= 2 or (pos == 0 and tail):
+                break
+    if not tail.endswith(b'\n'):
+        # Drop the unterminated last line
+        tail = tail[:tail.rfind(b'\n') + 1]
+    lines = tail.strip().splitlines()
+    if not lines:
+        return None
+    first_field = lines[-1].split(b',', 1)[0].decode()
+    try:
+        return dt.date.fromisoformat(first_field[:10])
+    except ValueError:
+        # Only the header row is in the file
+        return None
+
+
+def truncate_partial_line(pth):
+    """ Truncates the file at `pth` after its last newline, removing an
+    unterminated last line. Returns the new size of the file.
+    """
+    with open(pth, 'rb+') as file:
+        size = file.seek(0, os.SEEK_END)
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            pos -= step
+            file.seek(pos)
+            i = file.read(step).rfind(b'\n')
+            if i != -1:
+                pos += i + 1
+                break
+        if pos != size:
+            file.truncate(pos)
+        return pos
+
+
+def append_atomic(pth, data):
+    """ Appends the newline-terminated rows `data` (bytes) to the file at `pth`.
+
+    The append is not atomic for concurrent readers, which can see some of the
+    new rows before the write completes. Only complete lines count as stored
+    rows: an unterminated last line left by an interrupted earlier append is
+    removed first (see `last_stored_date`), and if the write raises, the file
+    is truncated back to its size before the append. If the process is killed
+    during the write, the torn last line is ignored by `last_stored_date` and
+    removed by the next append.
+    """
+    size = truncate_partial_line(pth)
+    with open(pth, 'rb+') as file:
+        file.seek(size)
+        try:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.truncate(size)
+            raise
+
+
+def yf_prc_refresh(tic, pth, end=None, fetcher=None):
+    """ Brings the price CSV file at `pth` up to date by appending only the
+    missing rows.
+
+    The last stored date is read from the end of the file, only the dates after
+    it are fetched, and the new rows are appended with `append_atomic`. An
+    unterminated last line is removed even when there are no new rows. If the
+    file does not exist yet, the full history is downloaded with `yf_prc_to_csv`.
+
+    Parameters
+    ----------
+    tic : str
+        Ticker
+
+    pth : str
+        Location of the CSV file
+
+    end: str, optional
+        Download end date string (YYYY-MM-DD)
+        If None (the default), end is set to the most current date available
+
+    fetcher: callable, optional
+        A function with the same signature as `yf_download`.
+        If None (the default), prices are downloaded from Yahoo Finance
+
+    Returns
+    -------
+    int
+        The number of rows appended (or written, for a new file)
+    """
+    if fetcher is None:
+        fetcher = yf_download
+    last = last_stored_date(pth) if os.path.exists(pth) else None
+    if last is None:
+        return yf_prc_to_csv(tic, pth, end=end, fetcher=fetcher)
+    # Repair a torn last line now, even if there is nothing new to append
+    truncate_partial_line(pth)
+
+    start = last + dt.timedelta(days=1)
+    if end is not None and start.isoformat() > end:
+        return 0
+    df = fetcher(tic, start=start.isoformat(), end=end)
+    # Some sources return the start date inclusive of earlier rows
+    df = df[df.index.date > last]
+    if len(df) == 0:
+        return 0
+
+    with open(pth, 'r') as file:
+        header = file.readline().strip().split(',')
+    df = df[header[1:]]
+    append_atomic(pth, df.to_csv(header=False).encode())
+    return len(df)
 
-    def add(a, b):
-        """ Returns the sum of two numbers """
-        return a + b
 
 # Example
 if __name__ == "__main__":
@@ -5,6 +5,7 @@ This module is for download the stock price of Qantas and save as CSV file.
 
 import os
 from yf_example2 import yf_prc_to_csv
+from yf_bulk import run_jobs
 
 data_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
@@ -25,5 +26,27 @@ def qan_prc_to_csv(year):
 
     yf_prc_to_csv('QAN.AX', path, start=start_date, end=end_date)
 
+def qan_prc_years_to_csv(years, fetcher=None, max_workers=4):
+    """
+    Downloads Qantas stock prices for several years concurrently, one CSV file per year.
+    Years already downloaded in a previous (possibly interrupted) run are skipped.
+
+    Parameters:
+    years (list): The years for which to download stock prices.
+    fetcher (callable, optional): See `yf_bulk.run_jobs`.
+    max_workers (int): Maximum number of downloads running at the same time.
+
+    Returns:
+    dict: The status of each year, see `yf_bulk.run_jobs`.
+    """
+    if not os.path.exists(data_folder):
+        os.makedirs(data_folder)
+
+    jobs = {f"qan_{year}": ('QAN.AX', f"{year}-01-01", f"{year}-12-31",
+                            os.path.join(data_folder, f"qan_prc_{year}.csv"))
+            for year in years}
+    ckpt_pth = os.path.join(data_folder, '_qan_checkpoint.json')
+    return run_jobs(jobs, fetcher=fetcher, max_workers=max_workers, ckpt_pth=ckpt_pth)
+
 if __name__ == "__main__":
     qan_prc_to_csv(2020)